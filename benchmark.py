@@ -0,0 +1,86 @@
+# Welcome to Polyominomania
+# See the README.md and github.com/Jelmerro/Polyominomania for more details
+# Released into the public domain, see UNLICENSE for details
+__license__ = "UNLICENSE"
+
+import json
+import os
+import time
+import timeit
+from argparse import ArgumentParser
+
+import bot
+import engine
+import polyomino
+
+
+def generate(repeat):
+    rng = polyomino.make_rng(0)
+    for number in [10, 20, 30]:
+        seconds = timeit.timeit(
+            lambda: polyomino.generate(number, rng), number=repeat)
+        print("generate {}: {:.3f} ms per piece".format(
+            number, seconds / repeat * 1000))
+
+
+def play(games):
+    with open(os.path.join("modes", "original.json")) as f:
+        config = json.load(f)
+    rng = polyomino.make_rng(0)
+    actions = [
+        lambda game: game.move("left"),
+        lambda game: game.move("right"),
+        lambda game: game.rotate(),
+        lambda game: game.rotate(False),
+        lambda game: game.soft_drop(),
+        lambda game: game.drop_piece(),
+        lambda game: game.hard_drop()
+    ]
+    moves = 0
+    start = time.perf_counter()
+    for _ in range(0, games):
+        game = engine.Engine(config, rng)
+        game.load_pieces()
+        game.start()
+        while not game.game_over:
+            rng.choice(actions)(game)
+            game.pop_events()
+            moves += 1
+    seconds = time.perf_counter() - start
+    print("engine: {} moves in {} games, {:.0f} moves per second".format(
+        moves, games, moves / seconds))
+
+
+def plan(repeat, number, width, height):
+    with open(os.path.join("modes", "original.json")) as f:
+        config = json.load(f)
+    config["width"] = width
+    config["height"] = height
+    config["polyominoes"] = {
+        str(number): {"next_piece": "jit", "chance": 1, "colors": "original"}
+    }
+    rng = polyomino.make_rng(0)
+    player = bot.Bot()
+    seconds = 0
+    for _ in range(0, repeat):
+        game = engine.Engine(config, rng)
+        game.start()
+        seconds += timeit.timeit(lambda: player.plan(game), number=1)
+    print("bot plan {} on a {}x{} board: {:.3f} ms per piece".format(
+        number, width, height, seconds / repeat * 1000))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Measure the speed of the parts of "
+                            "Polyominomania that don't need a window.")
+    parser.add_argument("--repeat", type=int, default=1000,
+                        help="How many times each measurement is repeated.")
+    parser.add_argument("--games", type=int, default=100,
+                        help="How many games the engine plays with random "
+                        "moves.")
+    args = parser.parse_args()
+    generate(args.repeat)
+    play(args.games)
+    plan(args.repeat, 10, 20, 20)
+    # the largest modes, with fewer repeats as each piece takes longer
+    plan(max(1, args.repeat // 100), 30, 200, 200)
@@ -0,0 +1,224 @@
+# Welcome to Polyominomania
+# See the README.md and github.com/Jelmerro/Polyominomania for more details
+# Released into the public domain, see UNLICENSE for details
+__license__ = "UNLICENSE"
+
+import collections
+import functools
+import operator
+
+# Weights of the default heuristics, applied to the board after a placement
+WEIGHTS = {
+    "lines": 0.76,
+    "height": -0.51,
+    "holes": -0.36,
+    "bumpiness": -0.18
+}
+
+
+def lines(board):
+    return board["lines"]
+
+
+def height(board):
+    return sum(board["heights"])
+
+
+def holes(board):
+    return board["holes"]
+
+
+def bumpiness(board):
+    heights = board["heights"]
+    return sum(map(abs, map(operator.sub, heights, heights[1:])))
+
+
+HEURISTICS = {
+    "lines": lines,
+    "height": height,
+    "holes": holes,
+    "bumpiness": bumpiness
+}
+
+
+@functools.lru_cache(1024)
+def shapes(orientations):
+    # every orientation as a width, a height and a bitmask for each row
+    table = []
+    for squares, shift_cw, shift_ccw in orientations:
+        width = max(x for x, _ in squares) + 1
+        height = max(y for _, y in squares) + 1
+        masks = [0] * height
+        for x, y in squares:
+            masks[y] |= 1 << x
+        table.append((width, height, tuple(masks), shift_cw, shift_ccw))
+    return tuple(table)
+
+
+def columns(game):
+    # the locked blocks of each column as a bitmask of the rows
+    result = [0] * game.width
+    for y, row in enumerate(game.rows):
+        while row:
+            low = row & -row
+            result[low.bit_length() - 1] |= 1 << y
+            row ^= low
+    return result
+
+
+def placements(game):
+    # search all positions the current piece can reach with the moves of
+    # the player, a position is a placement if the piece can't fall further,
+    # each placement comes with a short list of moves to get there.
+    # Each line of the piece (orientation and column) is a bitmask of the
+    # rows where it collides, so the piece falls through a whole stretch of
+    # free rows at once and only moves to the side and rotations are
+    # searched, for all rows of the stretch together
+    if not game.current:
+        return {}
+    table = shapes(game.current_orientations)
+    board = columns(game)
+    lines = {}
+
+    def blocked(orientation, left):
+        if (orientation, left) not in lines:
+            width, height, _, _, _ = table[orientation]
+            if left < 0 or left + width > game.width:
+                mask = -1
+            else:
+                # the floor blocks every row the piece would stick out of
+                mask = -1 << game.height - height + 1
+                for x, y in game.current_orientations[orientation][0]:
+                    mask |= board[left + x] >> y
+            lines[(orientation, left)] = mask
+        return lines[(orientation, left)]
+
+    def landing(orientation, left, top):
+        # the row above the first blocked row below the top
+        below = blocked(orientation, left) >> top + 1
+        return top + (below & -below).bit_length() - 1
+
+    # a node is a line entered at a row, with the row it lands on,
+    # and the node, move and row it was entered from
+    orientation = game.current_orientation
+    left = min(x for x, _ in game.current)
+    top = min(y for _, y in game.current)
+    land = landing(orientation, left, top)
+    nodes = [(orientation, left, top, land, None)]
+    # highest row each stretch of free rows was entered at
+    entered = {(orientation, left, land): top}
+    queue = collections.deque([0])
+    found = {}
+    while queue:
+        index = queue.popleft()
+        orientation, left, top, land, _ = nodes[index]
+        squares = frozenset(
+            (left + x, land + y)
+            for x, y in game.current_orientations[orientation][0])
+        if squares not in found:
+            found[squares] = index
+        stretch = (2 << land) - (1 << top)
+        _, _, _, shift_cw, shift_ccw = table[orientation]
+        moves = [
+            ("rotate", (orientation + 1) % 4, shift_cw),
+            ("rotate_ccw", (orientation - 1) % 4, shift_ccw),
+            ("left", orientation, (-1, 0)),
+            ("right", orientation, (1, 0))
+        ]
+        for action, turned, (dx, dy) in moves:
+            if dy >= 0:
+                rows = stretch << dy
+            else:
+                rows = stretch >> -dy
+            rows &= ~blocked(turned, left + dx)
+            while rows:
+                row = (rows & -rows).bit_length() - 1
+                new_land = landing(turned, left + dx, row)
+                stretch_key = (turned, left + dx, new_land)
+                if row < entered.get(stretch_key, game.height):
+                    entered[stretch_key] = row
+                    nodes.append((
+                        turned, left + dx, row, new_land,
+                        (index, action, row - dy)))
+                    queue.append(len(nodes) - 1)
+                rows &= -2 << new_land
+    result = {}
+    for squares, index in found.items():
+        # walk back to the first node, the moves are collected in reverse,
+        # the last fall is left to a hard drop
+        actions = ["drop"]
+        parent = nodes[index][4]
+        while parent is not None:
+            index, action, row = parent
+            _, _, top, _, parent = nodes[index]
+            actions.append(action)
+            actions.extend(["down"] * (row - top))
+        actions.reverse()
+        result[squares] = actions
+    return result
+
+
+def analyse(game, squares):
+    rows = list(game.rows)
+    for x, y in squares:
+        rows[y] |= 1 << x
+    full_row = (1 << game.width) - 1
+    # only the rows of the piece can be full
+    full = {y for _, y in squares if rows[y] == full_row}
+    cleared = len(full)
+    if full:
+        rows = [0] * cleared + [row for row in rows if row != full_row]
+    # walk down the rows, remembering which columns have a block above,
+    # starting at the highest block as all rows above it are empty
+    first = min(min(game.surface), min(y for _, y in squares)) + cleared
+    heights = [0] * game.width
+    covered_squares = 0
+    covered = 0
+    for depth in range(first, game.height):
+        row = rows[depth]
+        top = row & ~covered
+        while top:
+            column = (top & -top).bit_length() - 1
+            heights[column] = game.height - depth
+            top &= top - 1
+        covered_squares += bin(covered & ~row & full_row).count("1")
+        covered |= row
+    return {
+        "rows": rows,
+        "lines": cleared,
+        "heights": heights,
+        "holes": covered_squares
+    }
+
+
+class Bot:
+
+    def __init__(self, weights=None, heuristics=None):
+        """ Placement Bot
+
+        Plays the current piece of an engine at the best placement it can
+        reach, rating the board after each placement with heuristics.
+        Both the heuristics and their weights can be replaced,
+        by default the lines, height, holes and bumpiness are used.
+        """
+        self.weights = weights or WEIGHTS
+        self.heuristics = heuristics or HEURISTICS
+
+    def evaluate(self, game, squares):
+        board = analyse(game, squares)
+        return sum(
+            weight * self.heuristics[name](board)
+            for name, weight in self.weights.items())
+
+    def plan(self, game):
+        best = None
+        for squares, actions in placements(game).items():
+            value = self.evaluate(game, squares)
+            if best is None or value > best[0]:
+                best = (value, actions)
+        if best is None:
+            return ["drop"]
+        return best[1]
+
+    def act(self, game, action):
+        return game.act(action)
@@ -0,0 +1,233 @@
+# Welcome to Polyominomania
+# See the README.md and github.com/Jelmerro/Polyominomania for more details
+# Released into the public domain, see UNLICENSE for details
+__license__ = "UNLICENSE"
+
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import polyomino
+
+
+def check_conf(config):
+    # root fields
+    root_fields = [
+        "description",
+        "polyominoes",
+        "scoring",
+        "lines_per_level",
+        "first_level",
+        "speed",
+        "speed_per_level",
+        "width",
+        "height",
+        "next_pieces",
+        "ghost",
+        "extra_spacing"
+    ]
+    for field in root_fields:
+        if field not in config:
+            return False, "Missing an essential field: {}".format(field)
+    # description
+    if not isinstance(config["description"], str):
+        return False, "Description must be a string"
+    # polyominoes
+    if len(config["polyominoes"]) == 0:
+        return False, "Zero polyomino sets"
+    largest_set = 0
+    for k, _ in config["polyominoes"].items():
+        if not k.isdigit():
+            return False, "Polyomino id must be a number"
+        number = int(k)
+        if number > largest_set:
+            largest_set = number
+        if number > 30 or number < 1:
+            return False, "Polyomino id must be between 0 and 31"
+        for field in ["next_piece", "colors"]:
+            if field not in config["polyominoes"][k]:
+                return False, "Missing a polyomino field in number " \
+                              "{}: {}".format(number, field)
+            if not isinstance(config["polyominoes"][k][field], str):
+                return False, "Field {} in Polyomino {} must be a " \
+                              "str".format(field, number)
+        acc = ["random", "jit", "bag"]
+        if config["polyominoes"][k]["next_piece"] not in acc:
+            return False, "next_piece in polyomino {} must be random" \
+                          ", bag or jit".format(number)
+        supported = polyomino.supported_color_schemes()
+        if config["polyominoes"][k]["colors"] not in supported:
+            return False, "color set in polyomino {} is not " \
+                          "a valid set, try original".format(number)
+        # chance
+        if "chance" not in config["polyominoes"][k]:
+            return False, "Missing a polyomino field in number " \
+                          "{}: chance".format(number)
+        if not isinstance(config["polyominoes"][k]["chance"], int):
+            return False, "chance in polyomino {} must be " \
+                          "an int".format(number)
+        if config["polyominoes"][k]["chance"] < 1:
+            return False, "chance in polyomino {} must be " \
+                          "at least 1".format(number)
+
+    # scoring
+    scoring_fields = [
+        "polyomino",
+        "lines",
+        "lines_per_level",
+        "softdrop",
+        "harddrop",
+        "level_up"
+    ]
+    for field in scoring_fields:
+        if field not in config["scoring"]:
+            return False, "Missing a scoring field: {}".format(field)
+    for field in ["polyomino", "softdrop", "harddrop", "level_up"]:
+        if not isinstance(config["scoring"][field], int):
+            return False, "Field {} in scoring must be an int".format(
+                field)
+    for number in range(1, largest_set+1):
+        if (
+            str(number) in config["scoring"]["lines"] and
+            str(number) in config["scoring"]["lines_per_level"]
+        ):
+            if (
+                isinstance(
+                    config["scoring"]["lines"][str(number)], int) and
+                isinstance(
+                    config["scoring"]["lines_per_level"][str(number)],
+                    int)
+            ):
+                continue
+        return False, "No scoring defined for {} line{}".format(
+            number,
+            "s" if number > 1 else "")
+    # next_pieces
+    if not isinstance(config["next_pieces"], int):
+        return False, "next_pieces must be an int"
+    if config["next_pieces"] > 4 or config["next_pieces"] < 0:
+        return False, "next_pieces must be at least 0 and not more than 4"
+    # ghost
+    if not isinstance(config["ghost"], bool):
+        return False, "ghost must be a bool"
+    # width and height
+    for field in ["height", "width"]:
+        if not isinstance(config[field], int):
+            return False, "{} must be an int".format(field)
+        if not int(config[field]) > largest_set:
+            return False, "{} must be above largest set size ({})".format(
+                field,
+                largest_set)
+    # extra_spacing
+    if not isinstance(config["extra_spacing"], bool):
+        return False, "extra_spacing must be a bool"
+    # other fields
+    other_fields = [
+        "lines_per_level",
+        "first_level",
+        "speed",
+        "speed_per_level"
+    ]
+    for field in other_fields:
+        if not isinstance(config[field], int):
+            return False, "{} must be an int".format(field)
+        if not int(config[field]) > 0:
+            return False, "{} must be above zero".format(field)
+    # looks good
+    return True, "Configuration looks good :)"
+
+
+def load_mode(path):
+    try:
+        with open(path) as f:
+            config = json.loads(f.read())
+    except OSError:
+        return {"config": {}, "valid": False, "log": "Missing file"}
+    except (UnicodeDecodeError, json.decoder.JSONDecodeError):
+        return {"config": {}, "valid": False, "log": "Invalid json"}
+    if not isinstance(config, dict):
+        return {"config": {}, "valid": False, "log": "Invalid json"}
+    try:
+        valid, log = check_conf(config)
+    except (AttributeError, KeyError, TypeError):
+        valid, log = False, "Invalid structure, compare with original.json"
+    return {"config": config, "valid": valid, "log": log}
+
+
+class ModeCatalog:
+
+    def __init__(self, folder="modes", workers=None):
+        """ Mode Catalog
+
+        Reads and checks all the mode files of a folder on a thread pool,
+        so the menu can show them without waiting for the disk.
+        Results are cached by path and modification time,
+        a rescan only loads the files that were added or changed.
+        The version goes up every time the list or a result changes.
+        """
+        self.folder = folder
+        self.executor = ThreadPoolExecutor(workers)
+        self.lock = threading.Lock()
+        # modification time of each file in the folder, by name
+        self.files = {}
+        # loaded modes, by path and modification time
+        self.cache = {}
+        self.version = 0
+        self.scanning = False
+        self.scanned = False
+
+    def refresh(self):
+        # scan the folder in the background, unless a scan is still running
+        with self.lock:
+            if self.scanning:
+                return
+            self.scanning = True
+        self.executor.submit(self.scan)
+
+    def scan(self):
+        files = {}
+        try:
+            for entry in os.scandir(self.folder):
+                if entry.is_file():
+                    files[entry.name] = entry.stat().st_mtime_ns
+        except OSError:
+            pass
+        with self.lock:
+            self.scanning = False
+            if files == self.files and self.scanned:
+                return
+            self.scanned = True
+            for name, mtime in self.files.items():
+                if files.get(name) != mtime:
+                    self.cache.pop((self.path(name), mtime), None)
+            for name, mtime in files.items():
+                if self.files.get(name) != mtime:
+                    self.executor.submit(self.load, name, mtime)
+            self.files = files
+            self.version += 1
+
+    def load(self, name, mtime):
+        mode = load_mode(self.path(name))
+        with self.lock:
+            # a newer version of the file might have been found meanwhile
+            if self.files.get(name) == mtime:
+                self.cache[(self.path(name), mtime)] = mode
+                self.version += 1
+
+    def path(self, name):
+        return os.path.join(self.folder, name)
+
+    def names(self):
+        with self.lock:
+            return sorted(self.files)
+
+    def get(self, name):
+        # the loaded mode, or None if the file is unknown or still loading
+        with self.lock:
+            if name not in self.files:
+                return None
+            return self.cache.get((self.path(name), self.files[name]))
+
+    def close(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,275 @@
+# Welcome to Polyominomania
+# See the README.md and github.com/Jelmerro/Polyominomania for more details
+# Released into the public domain, see UNLICENSE for details
+__license__ = "UNLICENSE"
+
+import polyomino
+
+# Moves by name, as made by players, bots and replays,
+# with the method and the arguments they call
+ACTIONS = {
+    "start": ("start", ()),
+    "left": ("move", ("left",)),
+    "right": ("move", ("right",)),
+    "rotate": ("rotate", ()),
+    "rotate_ccw": ("rotate", (False,)),
+    "down": ("soft_drop", ()),
+    "drop": ("hard_drop", ()),
+    "gravity": ("drop_piece", ())
+}
+
+
+class Engine:
+
+    def __init__(self, config, rng):
+        """ Game Engine
+
+        All the rules of a game, without anything that needs a window.
+        Works on a board of colors, with a bitmask for each row,
+        and keeps a list of events for views to follow the changes:
+        lock, lines, piece, level and game_over.
+        """
+        self.config = config
+        self.rng = rng
+        self.width = config["width"]
+        self.height = config["height"]
+        self.block_sizes = polyomino.Sampler({
+            int(k): v["chance"] for k, v in config["polyominoes"].items()
+        }, self.rng)
+        self.largest_size = max(int(k) for k in config["polyominoes"])
+        self.blocks = {}
+        self.bags = {}
+        self.score = 0
+        self.lines = 0
+        self.current_level = config["first_level"]
+        # seconds between each drop of the current piece
+        spl = config["speed_per_level"]
+        self.interval = 10 / config["speed"] + spl * (self.current_level - 1)
+        # board, with the color of the locked block at each position or None
+        self.colors = [[None] * self.width for _ in range(0, self.height)]
+        # rows of the board as bitmasks, with the left column as bit 0
+        self.rows = [0] * self.height
+        # highest locked block of each column, the height if there are none
+        self.surface = [self.height] * self.width
+        # current piece, with the board position of each square
+        self.current = []
+        self.current_block = None
+        self.current_color = None
+        self.current_orientations = None
+        self.current_orientation = 0
+        self.block_queue = []
+        self.block_queue_colors = []
+        self.game_over = False
+        self.events = []
+
+    def load_pieces(self, progress=None):
+        for k, v in self.config["polyominoes"].items():
+            if v["next_piece"] != "jit":
+                self.blocks[int(k)] = polyomino.library(int(k), progress)
+            if v["next_piece"] == "bag":
+                self.bags[int(k)] = polyomino.Bag(
+                    self.blocks[int(k)], self.rng)
+
+    def act(self, action):
+        method, args = ACTIONS[action]
+        return getattr(self, method)(*args)
+
+    def pop_events(self):
+        events = self.events
+        self.events = []
+        return events
+
+    def start(self):
+        self.block_queue = []
+        self.block_queue_colors = []
+        for _ in range(0, self.config["next_pieces"]):
+            self.queue_piece()
+        self.next_piece()
+        return True
+
+    def new_piece(self):
+        size = self.block_sizes.pick()
+        if size in self.bags:
+            return self.bags[size].draw()
+        if size in self.blocks:
+            return self.rng.choice(self.blocks[size])
+        return polyomino.generate(size, self.rng)
+
+    def queue_piece(self):
+        new_piece = self.new_piece()
+        self.block_queue.append(new_piece)
+        scheme = self.config["polyominoes"][str(new_piece.size)]["colors"]
+        self.block_queue_colors.append(
+            polyomino.color(new_piece, scheme, self.rng))
+
+    def next_piece(self):
+        self.lock_piece()
+        if self.game_over:
+            self.events.append(("game_over",))
+            return
+        self.queue_piece()
+        self.current_block = self.block_queue.pop(0)
+        self.current_color = self.block_queue_colors.pop(0)
+        self.current_orientations = self.current_block.orientations
+        self.current_orientation = 0
+        block_width = self.current_block.height
+        width = int(self.width / 2 + 1 - block_width / 2)
+        self.current = [(width + x, y) for x, y in self.current_block.cells]
+        self.events.append(("piece",))
+
+    def lock_piece(self):
+        locked = []
+        for x, y in self.current:
+            if y < 3:
+                self.game_over = True
+                break
+            self.colors[y][x] = self.current_color
+            self.rows[y] |= 1 << x
+            self.surface[x] = min(self.surface[x], y)
+            locked.append((x, y, self.current_color))
+        if locked:
+            self.events.append(("lock", locked))
+
+    def fits(self, x, y):
+        if x < 0 or y < 0 or x >= self.width or y >= self.height:
+            return False
+        return not self.rows[y] >> x & 1
+
+    def rotate(self, clockwise=True):
+        if self.game_over:
+            return False
+        _, shift_cw, shift_ccw = self.current_orientations[
+            self.current_orientation]
+        if clockwise:
+            orientation = (self.current_orientation + 1) % 4
+            shift_x, shift_y = shift_cw
+        else:
+            orientation = (self.current_orientation - 1) % 4
+            shift_x, shift_y = shift_ccw
+        left = min(x for x, _ in self.current)
+        top = min(y for _, y in self.current)
+        rotated = [
+            (left + x + shift_x, top + y + shift_y)
+            for x, y in self.current_orientations[orientation][0]]
+        for x, y in rotated:
+            if not self.fits(x, y):
+                return False
+        self.current = rotated
+        self.current_orientation = orientation
+        return True
+
+    def move(self, direction):
+        if self.game_over:
+            return False
+        if direction == "right":
+            movement = 1
+        elif direction == "left":
+            movement = -1
+        for x, y in self.current:
+            if not self.fits(x + movement, y):
+                return False
+        self.current = [(x + movement, y) for x, y in self.current]
+        return True
+
+    def landing_distance(self, squares):
+        # squares above the surface of their column can fall down to it,
+        # squares below an overhang look for the first locked block below
+        distance = self.height
+        for x, y in squares:
+            if y < self.surface[x]:
+                below = self.surface[x]
+            else:
+                below = y + 1
+                while below < self.height:
+                    if self.rows[below] >> x & 1:
+                        break
+                    below += 1
+            distance = min(distance, below - 1 - y)
+        return distance
+
+    def ghost(self):
+        distance = self.landing_distance(self.current)
+        return [(x, y + distance) for x, y in self.current]
+
+    def soft_drop(self):
+        if self.drop_piece():
+            self.score += self.config["scoring"]["softdrop"]
+            return True
+        return False
+
+    def hard_drop(self):
+        if self.game_over:
+            return False
+        distance = self.landing_distance(self.current)
+        self.current = [(x, y + distance) for x, y in self.current]
+        self.score += self.config["scoring"]["harddrop"] * distance
+        self.drop_piece()
+        return True
+
+    def drop_piece(self):
+        if self.game_over:
+            return False
+        for x, y in self.current:
+            if not self.fits(x, y + 1):
+                break
+        else:
+            self.current = [(x, y + 1) for x, y in self.current]
+            return True
+        self.score += self.config["scoring"]["polyomino"]
+        self.next_piece()
+        self.process_lines()
+        return False
+
+    def process_lines(self):
+        # find all full rows at once, then move every remaining row down
+        # by the number of full rows below it
+        full_row = (1 << self.width) - 1
+        kept = [
+            line for line in range(0, self.height)
+            if self.rows[line] != full_row]
+        number_of_lines = self.height - len(kept)
+        if number_of_lines:
+            self.events.append(("lines", [
+                line for line in range(0, self.height)
+                if self.rows[line] == full_row]))
+            self.colors = [
+                [None] * self.width for _ in range(0, number_of_lines)
+            ] + [self.colors[line] for line in kept]
+            self.rows = [0] * number_of_lines + [
+                self.rows[line] for line in kept]
+            self.update_surface()
+        self.update_score_by_lines(number_of_lines)
+
+    def update_surface(self):
+        self.surface = [self.height] * self.width
+        remaining = (1 << self.width) - 1
+        for line, row in enumerate(self.rows):
+            found = row & remaining
+            remaining &= ~found
+            while found:
+                column = (found & -found).bit_length() - 1
+                self.surface[column] = line
+                found &= found - 1
+            if not remaining:
+                break
+
+    def next_level(self):
+        self.score += self.config["scoring"]["level_up"]
+        self.current_level += 1
+        spl = self.config["speed_per_level"]
+        self.interval = 10 / (
+            self.config["speed"] + spl * (self.current_level - 1))
+        self.events.append(("level", self.current_level))
+
+    def update_score_by_lines(self, n):
+        if n == 0:
+            return
+        self.lines += n
+        required_level = int(self.lines / self.config["lines_per_level"])
+        required_level -= self.config["first_level"]
+        required_level += 2
+        while required_level > self.current_level:
+            self.next_level()
+        base_score = self.config["scoring"]["lines"][str(n)]
+        level_score = self.config["scoring"]["lines_per_level"][str(n)]
+        self.score += base_score + level_score * (self.current_level - 1)
@@ -3,7 +3,17 @@
 # Released into the public domain, see UNLICENSE for details
 __license__ = "UNLICENSE"
 
-from random import SystemRandom
+import array
+import functools
+import mmap
+import multiprocessing
+import os
+import random
+import struct
+import subprocess
+import sys
+import types
+import zlib
 
 # Number of one-sided polyominoes with n cells https://oeis.org/A000988
 A000988 = [
@@ -15,65 +25,164 @@ A000988 = [
     307022182222506, 1205243866707468, 4736694001644862
 ]
 
+# Header of the piece cache files, followed by the packed piece keys:
+# magic, version, size, record length, number of pieces and crc32 of the keys
+CACHE_HEADER = struct.Struct("<4sBBBxII")
+CACHE_MAGIC = b"PLYM"
+CACHE_VERSION = 1
 
-def generate(number):
-    grid = []
+# Sets of this size and larger are enumerated on all cores
+PARALLEL_SIZE = 10
+
+# Color schemes, with a color for each of the tetrominoes
+COLORS = {
+    "original": {
+        "o": "ffff00",  # yellow
+        "i": "00ffff",  # cyan
+        "t": "aa00ff",  # purple
+        "s": "00ff00",  # lime
+        "z": "ff0000",  # red
+        "j": "0000ff",  # blue
+        "l": "ffa500"   # orange
+    },
+    "retro": {
+        "o": "ff906b",
+        "i": "666547",
+        "t": "6fcb9f",
+        "s": "ffe28a",
+        "z": "fffeb3",
+        "j": "f9402f",
+        "l": "96d5ff"
+    },
+    "bootstrap": {
+        "o": "f0ad41",
+        "i": "5cb85c",
+        "t": "d9534f",
+        "s": "fff7f4",
+        "z": "5bc0de",
+        "j": "6c5196",
+        "l": "428bca"
+    },
+    "gray": {
+        "o": "444444",
+        "i": "666666",
+        "t": "888888",
+        "s": "aaaaaa",
+        "z": "cccccc",
+        "j": "e8e8e8",
+        "l": "ffffff"
+    }
+}
+
+# The tetrominoes by name, used to give them the same color in any rotation
+TETROMINOES = {
+    "o": [[1, 1], [1, 1]],
+    "i": [[1], [1], [1], [1]],
+    "t": [[0, 1], [1, 1], [0, 1]],
+    "s": [[1, 0], [1, 1], [0, 1]],
+    "z": [[0, 1], [1, 1], [1, 0]],
+    "j": [[0, 1], [0, 1], [1, 1]],
+    "l": [[1, 1], [0, 1], [0, 1]]
+}
+
+
+class Piece:
+
+    __slots__ = (
+        "key", "canonical", "cells", "size", "width", "height",
+        "name", "colors", "orientations")
+
+    def __init__(self, key):
+        """ Polyomino Piece
+
+        A polyomino in a single orientation, created from its key.
+        All the properties are calculated once and can't be changed:
+        key, canonical, cells, size, width, height, name, colors, orientations
+        """
+        width = key & 31
+        mask = key >> 5
+        squares = tuple(
+            (i % width, i // width) for i in range(0, mask.bit_length())
+            if mask >> i & 1)
+        name = tetromino_names().get(canonical_key(squares), "")
+        properties = {
+            "key": key,
+            "canonical": canonical_key(squares),
+            "cells": squares,
+            "size": len(squares),
+            "width": width,
+            "height": (mask.bit_length() - 1) // width + 1,
+            "name": name,
+            "colors": {},
+            "orientations": orientations(key)
+        }
+        if name:
+            for scheme, palette in COLORS.items():
+                properties["colors"][scheme] = rgba(palette[name])
+        properties["colors"] = types.MappingProxyType(properties["colors"])
+        for field, value in properties.items():
+            object.__setattr__(self, field, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Piece properties can't be changed")
+
+    def __reduce__(self):
+        # copies and pickles are made from the key, like any other piece
+        return (get_piece, (self.key,))
+
+    def __eq__(self, other):
+        return isinstance(other, Piece) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def grid(self):
+        return from_key(self.key)
+
+
+@functools.lru_cache(maxsize=1024)
+def get_piece(key):
+    return Piece(key)
+
+
+def generate(number, rng):
+    # random walk inside a box of number by number / 2 + 0.5 squares
+    xnum = number
     ynum = int(number / 2 + 0.5)
-    # generate empty grid of desired size
-    for _ in range(0, number):
-        line = []
-        for _ in range(0, ynum):
-            line.append(0)
-        grid.append(line)
     # start at random location
-    x = SystemRandom().randrange(number)
-    y = SystemRandom().randrange(ynum)
-    grid[x][y] = 1
+    x = rng.randrange(xnum)
+    y = rng.randrange(ynum)
+    squares = {(x, y)}
+    min_x, max_x, min_y, max_y = x, x, y, y
     # walk into a random direction for the amount of squares needed
-    while sum(sum(grid, []), 0) != number:
+    while len(squares) != number:
         new_x = -1
         new_y = -1
-        while new_x < 0 or new_y < 0 or new_x >= number or new_y >= ynum:
+        while new_x < 0 or new_y < 0 or new_x >= xnum or new_y >= ynum:
             new_x = x
             new_y = y
-            if SystemRandom().choice([True, False]):
-                new_x += SystemRandom().choice([1, -1])
-                new_y = y
+            if rng.choice([True, False]):
+                new_x += rng.choice([1, -1])
             else:
-                new_x = x
-                new_y += SystemRandom().choice([1, -1])
+                new_y += rng.choice([1, -1])
         x = new_x
         y = new_y
-        grid[x][y] = 1
-    # delete empty rows
-    while sum(grid[0]) == 0:
-        grid.pop(0)
-    while sum(grid[len(grid)-1]) == 0:
-        grid.pop(len(grid)-1)
-    # clear columns left
-    for _ in range(0, number):
-        first_column_empty = True
-        for i in range(0, len(grid)):
-            if grid[i][0] == 1:
-                first_column_empty = False
-                break
-        if not first_column_empty:
-            break
-        else:
-            for i, _ in enumerate(grid):
-                grid[i].pop(0)
-    # clear columns right
-    for _ in range(0, number):
-        first_column_empty = True
-        for i, _ in enumerate(grid):
-            if grid[i][len(grid[i])-1] == 1:
-                first_column_empty = False
-                break
-        if not first_column_empty:
-            break
-        for i, _ in enumerate(grid):
-            grid[i].pop(len(grid[i])-1)
-    return grid
+        squares.add((x, y))
+        min_x, max_x = min(min_x, x), max(max_x, x)
+        min_y, max_y = min(min_y, y), max(max_y, y)
+    # the walk's x is the row of the piece and y the column
+    width = max_y - min_y + 1
+    mask = 0
+    for x, y in squares:
+        mask |= 1 << ((x - min_x) * width + y - min_y)
+    return Piece(mask << 5 | width)
+
+
+def make_rng(seed=None, system=False):
+    # fast and reproducible with a seed, or the OS source of randomness
+    if system:
+        return random.SystemRandom()
+    return random.Random(seed)
 
 
 def rotate(piece, clockwise=True):
@@ -90,16 +199,42 @@ def fix_rotation_position(piece, rotated):
     return x, y
 
 
+@functools.lru_cache(maxsize=1024)
+def orientations(piece_key):
+    # the squares of a piece in all four orientations (clockwise),
+    # together with the shift needed to rotate clockwise or counter-clockwise
+    width = piece_key & 31
+    squares = cells(from_key(piece_key))
+    height = max(y for _, y in squares) + 1
+    turns = []
+    for _ in range(0, 4):
+        turns.append((tuple(squares), cells_center(squares, width, height)))
+        squares = sorted(
+            ((height - 1 - y, x) for x, y in squares),
+            key=lambda square: (square[1], square[0]))
+        width, height = height, width
+    table = []
+    for i, (squares, (old_x, old_y)) in enumerate(turns):
+        new_x, new_y = turns[(i + 1) % 4][1]
+        clockwise = (old_x - new_x, old_y - new_y)
+        new_x, new_y = turns[(i - 1) % 4][1]
+        counter = (old_x - new_x, old_y - new_y)
+        table.append((squares, clockwise, counter))
+    return tuple(table)
+
+
 def center_point(piece):
+    return cells_center(cells(piece), len(piece[0]), len(piece))
+
+
+def cells_center(cells, width, height):
+    # average of the filled squares, divided by all squares in the box
     total_x = 0
     total_y = 0
-    total_points = 0
-    for y, _ in enumerate(piece):
-        for x, _ in enumerate(piece[y]):
-            if piece[y][x] == 1:
-                total_x += x
-                total_y += y
-            total_points += 1
+    for x, y in cells:
+        total_x += x
+        total_y += y
+    total_points = width * height
     average_x = total_x / total_points
     average_y = total_y / total_points
     fixed_x = weird_rounding(average_x)
@@ -114,121 +249,381 @@ def weird_rounding(number):
     return int(number)
 
 
-def duplicate(pieces, piece):
-    for _ in range(0, 4):
-        if piece in pieces:
-            return True
-        piece = rotate(piece)
-    return False
+def cells(piece):
+    return [
+        (x, y) for y, row in enumerate(piece)
+        for x, square in enumerate(row) if square == 1]
+
+
+def rotation_keys(cells):
+    # keys of the piece in all four orientations, starting with the current
+    xs = [x for x, _ in cells]
+    ys = [y for _, y in cells]
+    width = max(xs) + 1
+    height = max(ys) + 1
+    mask, right, flipped, left = 0, 0, 0, 0
+    for x, y in zip(xs, ys):
+        mask |= 1 << (y * width + x)
+        right |= 1 << (x * height + height - 1 - y)
+        flipped |= 1 << ((height - 1 - y) * width + width - 1 - x)
+        left |= 1 << ((width - 1 - x) * height + y)
+    return [
+        mask << 5 | width,
+        right << 5 | height,
+        flipped << 5 | width,
+        left << 5 | height]
+
+
+def canonical_key(cells):
+    # the same key for all rotations of a piece: the lowest one of them
+    return min(rotation_keys(cells))
+
+
+def from_key(key):
+    # keys are a bitmask of the squares row by row,
+    # with the width in the lowest 5 bits
+    width = key & 31
+    mask = key >> 5
+    height = (mask.bit_length() - 1) // width + 1
+    return [
+        [mask >> (y * width + x) & 1 for x in range(0, width)]
+        for y in range(0, height)]
+
+
+def enumerate_keys(number):
+    width, cells, untried, seen = start_branch(number)
+    return branch_keys(number, width, cells, untried, seen)
+
+
+def start_branch(number):
+    # Redelmeier's algorithm: every fixed polyomino is grown exactly once,
+    # starting from the bottom-left cell, by only ever adding cells that
+    # haven't been considered yet in the current branch.
+    # Cells are numbered on a padded grid, with the start cell at (0, 0),
+    # in which the row below and the cells left of the start are blocked.
+    width = 2 * number + 1
+    seen = bytearray((number + 2) * width)
+    for i in range(0, width + number):
+        seen[i] = 1
+    for y in range(0, number + 2):
+        seen[y * width] = 1
+        seen[y * width + width - 1] = 1
+    start = width + number
+    seen[start] = 1
+    return width, [], [start], seen
+
+
+def grow(limit, width, cells, untried, seen):
+    while untried:
+        cell = untried.pop()
+        cells.append(cell)
+        if len(cells) == limit:
+            yield cells, untried
+        else:
+            new = neighbours(cell, width, seen)
+            yield from grow(limit, width, cells, untried + new, seen)
+            for n in new:
+                seen[n] = 0
+        cells.pop()
+
+
+def neighbours(cell, width, seen):
+    new = []
+    for n in (cell + 1, cell - 1, cell + width, cell - width):
+        if not seen[n]:
+            seen[n] = 1
+            new.append(n)
+    return new
+
+
+def branches(number, depth):
+    # independent parts of the enumeration, one for each fixed polyomino
+    # of the given depth, listed in the same order as they are enumerated
+    width, cells, untried, seen = start_branch(number)
+    for cells, untried in grow(depth, width, cells, untried, seen):
+        yield width, list(cells), list(untried), bytearray(seen)
+
+
+def branch_keys(number, width, cells, untried, seen):
+    if cells:
+        # continue growing from the last cell of the branch
+        untried = untried + neighbours(cells[-1], width, seen)
+    for fixed, _ in grow(number, width, cells, untried, seen):
+        left = min(c % width for c in fixed)
+        points = [(c % width - left, c // width - 1) for c in fixed]
+        # one-sided polyominoes only: skip all but one of the rotations
+        keys = rotation_keys(points)
+        if keys[0] == min(keys):
+            yield keys[0]
+
+
+def branch_records(args):
+    number, branch = args
+    return records(number, branch_keys(number, *branch))
+
+
+def records(number, keys):
+    record = record_length(number)
+    return b"".join(k.to_bytes(record, "little") for k in keys)
+
+
+def parallel_records(number, progress=None):
+    # split the enumeration into enough branches to keep all cores busy,
+    # results are merged in order, so the set is the same as when serial
+    depth = min(number - 4, 7)
+    tasks = ((number, branch) for branch in branches(number, depth))
+    body = []
+    count = 0
+    record = record_length(number)
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(os.cpu_count()) as pool:
+        for part in pool.imap(branch_records, tasks):
+            body.append(part)
+            count += len(part) // record
+            if progress:
+                progress(number, count)
+    return b"".join(body)
+
+
+def enumerate_all(number):
+    for piece_key in enumerate_keys(number):
+        yield Piece(piece_key)
 
 
 def generate_all(number):
-    pieces = []
-    while len(pieces) < A000988[number]:
-        piece = generate(number)
-        if not duplicate(pieces, piece):
-            pieces.append(piece)
-    return pieces
-
-
-def piece_name(piece):
-    name = ""
-    piece_o = [[1, 1], [1, 1]]
-    if piece == piece_o:
-        name = "o"
-    piece_i = [[1], [1], [1], [1]]
-    if piece == piece_i:
-        name = "i"
-    piece_t = [
-        [[0, 1], [1, 1], [0, 1]],
-        [[1, 0], [1, 1], [1, 0]]
-    ]
-    if piece in piece_t:
-        name = "t"
-    piece_s = [[1, 0], [1, 1], [0, 1]]
-    if piece == piece_s:
-        name = "s"
-    piece_z = [[0, 1], [1, 1], [1, 0]]
-    if piece == piece_z:
-        name = "z"
-    piece_j = [
-        [[0, 1], [0, 1], [1, 1]],
-        [[1, 1], [1, 0], [1, 0]]
-    ]
-    if piece in piece_j:
-        name = "j"
-    piece_l = [
-        [[1, 1], [0, 1], [0, 1]],
-        [[1, 0], [1, 0], [1, 1]]
-    ]
-    if piece in piece_l:
-        name = "l"
-    return name
-
-
-def color(piece, scheme):
-    name = piece_name(piece)
-    if not name:
-        name = SystemRandom().choice(list("oitszjl"))
-    colors = {
-        "original": {
-            "o": "ffff00",  # yellow
-            "i": "00ffff",  # cyan
-            "t": "aa00ff",  # purple
-            "s": "00ff00",  # lime
-            "z": "ff0000",  # red
-            "j": "0000ff",  # blue
-            "l": "ffa500"   # orange
-        },
-        "retro": {
-            "o": "ff906b",
-            "i": "666547",
-            "t": "6fcb9f",
-            "s": "ffe28a",
-            "z": "fffeb3",
-            "j": "f9402f",
-            "l": "96d5ff"
-        },
-        "bootstrap": {
-            "o": "f0ad41",
-            "i": "5cb85c",
-            "t": "d9534f",
-            "s": "fff7f4",
-            "z": "5bc0de",
-            "j": "6c5196",
-            "l": "428bca"
-        },
-        "gray": {
-            "o": "444444",
-            "i": "666666",
-            "t": "888888",
-            "s": "aaaaaa",
-            "z": "cccccc",
-            "j": "e8e8e8",
-            "l": "ffffff"
-        }
-    }
-    color = colors[scheme][name] + "ff"
+    return list(enumerate_all(number))
+
+
+class Library:
+
+    def __init__(self, number, data):
+        """ Polyomino Library
+
+        A read-only list of all pieces of one size,
+        stored as packed keys in a bytes-like object (usually a memory map).
+        Pieces are only turned into lists when they are requested.
+        """
+        self.number = number
+        self.data = data
+        self.record = record_length(number)
+        self.count = (len(data) - CACHE_HEADER.size) // self.record
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        return get_piece(self.key(i))
+
+    def __reduce__(self):
+        # the memory map can't be copied, the set is opened again instead
+        return (library, (self.number,))
+
+    def key(self, i):
+        if i < 0 or i >= self.count:
+            raise IndexError("library index out of range")
+        start = CACHE_HEADER.size + i * self.record
+        return int.from_bytes(self.data[start:start + self.record], "little")
+
+
+class Bag:
+
+    def __init__(self, pieces, rng):
+        """ Polyomino Bag
+
+        Draws all pieces of a set in a random order before any piece repeats.
+        Keeps a shuffled array of indexes into the set and a cursor,
+        so drawing a piece and refilling the bag don't copy any pieces.
+        """
+        self.pieces = pieces
+        self.rng = rng
+        self.order = array.array("I", range(0, len(pieces)))
+        self.cursor = 0
+
+    def __len__(self):
+        return len(self.order) - self.cursor
+
+    def draw(self):
+        if self.cursor == len(self.order):
+            self.cursor = 0
+        # shuffle one step at a time: swap a random remaining index forward
+        pick = self.rng.randrange(self.cursor, len(self.order))
+        order = self.order
+        order[self.cursor], order[pick] = order[pick], order[self.cursor]
+        self.cursor += 1
+        return self.pieces[order[self.cursor - 1]]
+
+
+class Sampler:
+
+    def __init__(self, weights, rng):
+        """ Weighted Sampler
+
+        Picks one of the keys of the weights dict, weighted by its int value.
+        Uses Vose's alias method with integer weights, so every pick takes
+        constant time and memory only grows with the number of keys.
+        """
+        self.rng = rng
+        self.values = list(weights)
+        count = len(self.values)
+        self.total = sum(weights.values())
+        # every column holds exactly "total" out of "count * total" chances,
+        # filled up by its own value and at most one other (the alias)
+        scaled = [weights[value] * count for value in self.values]
+        self.chances = [self.total] * count
+        self.aliases = list(range(0, count))
+        small = [i for i, w in enumerate(scaled) if w < self.total]
+        large = [i for i, w in enumerate(scaled) if w >= self.total]
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            self.chances[less] = scaled[less]
+            self.aliases[less] = more
+            scaled[more] -= self.total - scaled[less]
+            if scaled[more] < self.total:
+                small.append(more)
+            else:
+                large.append(more)
+
+    def pick(self):
+        column = self.rng.randrange(len(self.values))
+        if self.rng.randrange(self.total) < self.chances[column]:
+            return self.values[column]
+        return self.values[self.aliases[column]]
+
+
+def record_length(number):
+    # the bounding box of a piece holds (number + 1) ^ 2 / 4 squares at most
+    squares = (number + 1) // 2 * ((number + 2) // 2)
+    return (5 + squares + 7) // 8
+
+
+def pack(number, body):
+    record = record_length(number)
+    header = CACHE_HEADER.pack(
+        CACHE_MAGIC, CACHE_VERSION, number, record,
+        len(body) // record, zlib.crc32(body))
+    return header + body
+
+
+def cache_path(number):
+    return os.path.join("cache", "{}.bin".format(number))
+
+
+def load_cache(number):
+    try:
+        with open(cache_path(number), "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    if len(data) < CACHE_HEADER.size:
+        return None
+    magic, version, size, record, count, checksum = CACHE_HEADER.unpack(
+        data[:CACHE_HEADER.size])
+    valid = magic == CACHE_MAGIC and version == CACHE_VERSION
+    valid = valid and size == number and record == record_length(number)
+    valid = valid and count == A000988[number]
+    valid = valid and len(data) == CACHE_HEADER.size + count * record
+    if not valid or zlib.crc32(data[CACHE_HEADER.size:]) != checksum:
+        data.close()
+        return None
+    return Library(number, data)
+
+
+def library(number, progress=None):
+    cached = load_cache(number)
+    if cached:
+        return cached
+    if number >= PARALLEL_SIZE and (os.cpu_count() or 1) > 1:
+        # the workers of a pool start by importing the main module,
+        # so the pool runs in a helper process with this module as main,
+        # instead of loading the whole game again in every worker
+        helper(number, progress)
+        cached = load_cache(number)
+        if cached:
+            return cached
+    return build(number, progress)
+
+
+def helper(number, progress=None):
+    # enumerate in a separate process that writes the cache,
+    # the progress is read from its output
+    command = [sys.executable, os.path.abspath(__file__), str(number)]
+    try:
+        with subprocess.Popen(
+                command, stdout=subprocess.PIPE,
+                universal_newlines=True) as process:
+            for line in process.stdout:
+                if progress:
+                    progress(number, int(line))
+    except (OSError, ValueError):
+        pass
+
+
+def build(number, progress=None, parallel=False):
+    # enumerate all pieces of a size and store them in the cache
+    if parallel:
+        body = parallel_records(number, progress)
+    else:
+        keys = []
+        for piece_key in enumerate_keys(number):
+            keys.append(piece_key)
+            if progress and len(keys) % 1000 == 0:
+                progress(number, len(keys))
+        body = records(number, keys)
+    data = pack(number, body)
+    try:
+        os.makedirs("cache", exist_ok=True)
+        with open(cache_path(number) + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(cache_path(number) + ".tmp", cache_path(number))
+    except OSError:
+        return Library(number, data)
+    return load_cache(number) or Library(number, data)
+
+
+@functools.lru_cache()
+def tetromino_names():
+    return {
+        canonical_key(cells(piece)): name
+        for name, piece in TETROMINOES.items()}
+
+
+def color(piece, scheme, rng):
+    if scheme in piece.colors:
+        return piece.colors[scheme]
+    name = rng.choice(list("oitszjl"))
+    return rgba(COLORS[scheme][name])
+
+
+def rgba(color):
+    color += "ff"
     return tuple(int(color[i:i+2], 16) for i in (0, 2, 4, 6))
 
 
 def supported_color_schemes():
-    return ["original", "retro", "bootstrap", "gray"]
+    return list(COLORS)
 
 
 def install_times(number):
-    if number < 6:
+    if number < 10:
         time = "under a second"
-    elif number == 6:
+    elif number == 10:
+        time = "a second"
+    elif number == 11:
         time = "a few seconds"
-    elif number == 7:
-        time = "up to a minute"
-    elif number == 8:
+    elif number == 12:
+        time = "up to 30 seconds"
+    elif number == 13:
         time = "a few minutes"
-    elif number == 9:
+    elif number == 14:
         time = "up to 30 minutes"
-    elif number == 10:
-        time = "up to 3 hours"
     else:
-        time = "many days"
+        time = "many hours"
     return time
+
+
+if __name__ == "__main__":
+    # helper process of library, enumerates one size using all cores
+    def report(number, count):
+        print(count, flush=True)
+    build(int(sys.argv[1]), report, True)
@@ -5,6 +5,7 @@ __license__ = "UNLICENSE"
 
 import abc
 import calendar
+import collections
 import datetime
 import json
 import os
@@ -15,36 +16,76 @@ import time
 from argparse import ArgumentParser
 from random import SystemRandom
 
+import bot
+import catalog
+import engine
 import polyomino
+import profiler
+import replay
 import util
 
+# The game runs in fixed ticks, the window is drawn as often as it can be
+TICK = 1 / 60
+# Most time that is caught up with after a slow frame, in seconds
+MAX_CATCH_UP = 0.25
+# Ticks before a held key starts repeating and ticks between the repeats
+DAS = 30
+ARR = 3
+SOFT_DROP_DELAY = 10
+SOFT_DROP_RATE = 2
+
 
 class MainWindow(pyglet.window.Window):
 
-    def __init__(self, vsync):
+    def __init__(
+            self, vsync, seed, system_random, batched_board, autoplay,
+            playback=None, profile=None):
         super(MainWindow, self).__init__(
             caption="Polyominomania",
             visible=False,
             vsync=vsync)
         pyglet.gl.glClearColor(0.15, 0.15, 0.15, 255)
-        # main loop
-        pyglet.clock.schedule_interval(self.loop, 1/60.0)
+        # randomness of the games
+        self.seed = seed
+        self.system_random = system_random
+        # draw the board with vertex lists instead of a sprite per block
+        self.batched_board = batched_board
+        # let the computer play the games
+        self.autoplay = autoplay
+        # replay to show instead of a new game
+        self.playback = playback
+        # modes, read and checked in the background
+        self.catalog = catalog.ModeCatalog()
+        self.catalog.refresh()
+        # time spent in each part of a frame, written to the profile file
+        self.profiler = None
+        if profile is not None:
+            self.profiler = profiler.Profiler(profile)
+            self.loop = self.profiler.wrap("loop", self.loop)
+            self.on_draw = self.profiler.wrap_frame(
+                self.on_draw, self.profile_counts)
+        # main loop, called every frame to run the ticks that are due
+        self.accumulator = 0.0
+        pyglet.clock.schedule(self.loop)
         # keyboard inputs
         self.keyboard = pyglet.window.key.KeyStateHandler()
         self.push_handlers(self.keyboard)
         # scenes
         self.scenes = {}
-        self.scenes["menu"] = MenuScene()
+        self.scenes["menu"] = MenuScene(self.catalog)
+        self.profile_scene(self.scenes["menu"])
         self.current_scene = "menu"
+        if self.playback is not None:
+            self.scenes["menu"].config = self.playback.config
+            self.scenes["menu"].desired_scene = "game"
         # show
-        util.set_current_res(self.width, self.height)
         self.set_visible()
 
     def on_key_press(self, symbol, modifiers):
         if symbol == pyglet.window.key.F11:
             self.set_fullscreen(not self.fullscreen)
-            util.set_current_res(self.width, self.height)
-            self.scenes[self.current_scene].make_labels()
+        if symbol == pyglet.window.key.F3 and self.profiler is not None:
+            self.profiler.visible = not self.profiler.visible
         if symbol in [pyglet.window.key.RIGHT, pyglet.window.key.D]:
             self.scenes[self.current_scene].key("right")
         if symbol in [pyglet.window.key.LEFT, pyglet.window.key.A]:
@@ -61,31 +102,86 @@ class MainWindow(pyglet.window.Window):
             self.scenes[self.current_scene].key("other")
         return pyglet.event.EVENT_HANDLED
 
+    def on_resize(self, width, height):
+        scale = util.letterbox(*self.get_framebuffer_size())
+        util.LabelPool.set_scale(scale, ScaledGroup(scale))
+        return pyglet.event.EVENT_HANDLED
+
     def on_draw(self):
         self.clear()
         self.scenes[self.current_scene].draw()
+        if self.profiler is not None:
+            self.profiler.draw()
+
+    def on_close(self):
+        self.catalog.close()
+        if self.profiler is not None:
+            self.profiler.close()
+            print("Frame times written to {}".format(self.profiler.path))
+        super().on_close()
+
+    def profile_counts(self):
+        scene = self.scenes[self.current_scene]
+        counts = {
+            "sprites": len(getattr(scene, "entities", [])),
+            "labels": len(scene.labels.labels)
+        }
+        renderer = getattr(scene, "renderer", None)
+        if renderer is not None:
+            counts["quads"] = sum(len(s) for s in renderer.squares.values())
+        return counts
+
+    def profile_scene(self, scene):
+        if self.profiler is None:
+            return
+        scene.make_labels = self.profiler.wrap(
+            "relabel", scene.make_labels)
+        if isinstance(scene, GameScene):
+            scene.gravity = self.profiler.wrap("gravity", scene.gravity)
+            scene.engine.new_piece = self.profiler.wrap(
+                "generation", scene.engine.new_piece)
 
     def loop(self, dt):
+        # time left over is kept for the next frame,
+        # after a long pause only a limited amount is caught up with
+        self.accumulator = min(self.accumulator + dt, MAX_CATCH_UP)
+        while self.accumulator >= TICK:
+            self.accumulator -= TICK
+            self.tick()
+
+    def tick(self):
         desired = self.scenes[self.current_scene].desired_scene
         if desired == "menu" and "menu" != self.current_scene:
-            self.scenes["score"].clear()
-            self.scenes["menu"] = MenuScene()
+            self.scenes[self.current_scene].clear()
+            self.scenes["menu"] = MenuScene(self.catalog)
             self.scenes["menu"].make_labels()
+            self.profile_scene(self.scenes["menu"])
             self.current_scene = "menu"
         elif desired == "game" and "game" != self.current_scene:
             self.scenes["menu"].clear()
-            self.scenes["game"] = GameScene(self.scenes["menu"].config)
+            self.scenes["game"] = GameScene(
+                self.scenes["menu"].config,
+                self.seed,
+                self.system_random,
+                self.batched_board,
+                self.autoplay,
+                self.playback)
+            self.playback = None
             thr = threading.Thread(target=self.scenes["game"].init_blocks)
             thr.start()
             self.scenes["game"].make_labels()
+            self.profile_scene(self.scenes["game"])
             self.current_scene = "game"
         elif desired == "score" and "score" != self.current_scene:
             self.scenes["game"].clear()
             self.scenes["score"] = ScoreScene(
                 self.scenes["game"].config,
-                self.scenes["game"].score,
-                self.scenes["game"].lines)
+                self.scenes["game"].engine.score,
+                self.scenes["game"].engine.lines,
+                self.scenes["game"].seed,
+                self.scenes["game"].replay_path)
             self.scenes["score"].make_labels()
+            self.profile_scene(self.scenes["score"])
             self.current_scene = "score"
         # print(self.keyboard)
         keys = {}
@@ -96,7 +192,7 @@ class MainWindow(pyglet.window.Window):
         keys["select"] = self.combine_inputs(65293, 32)  # Enter - Space
         keys["back"] = self.combine_inputs(65288, 65307)  # Backspace - Esc
         keys["other"] = self.combine_inputs(65508, 101)  # RCTRL - E
-        self.scenes[self.current_scene].loop(dt, keys)
+        self.scenes[self.current_scene].loop(TICK, keys)
 
     def combine_inputs(self, input1, input2):
         if input1 in self.keyboard:
@@ -137,29 +233,33 @@ class Scene(metaclass=abc.ABCMeta):
 
 class MenuScene(Scene):
 
-    def __init__(self):
+    def __init__(self, catalog):
         super().__init__()
         self.name = "menu"
         self.desired_scene = "menu"
+        self.catalog = catalog
         self.selected_in_list = "original.json"
         self.list_items = []
-        if os.path.isdir("modes"):
-            self.list_items = sorted(os.listdir("modes"))
-        if len(self.list_items) == 0:
-            self.list_items = ["None"]
-            self.selected_in_list = self.list_items[0]
-        self.config_file = ""
+        self.update_list()
+        # selection and catalog version of the mode that is shown
+        self.shown = None
         self.config = {}
         self.valid_config = False
         self.config_log = ""
-        self.labels = []
+        self.loop_counter = 0
+        self.labels = util.LabelPool()
+
+    def update_list(self):
+        self.list_items = self.catalog.names()
+        if len(self.list_items) == 0:
+            self.list_items = ["None"]
 
     def make_labels(self):
-        self.labels = []
+        self.labels.begin()
         # title
-        self.labels.append(util.make_label(
+        self.labels.add(
             "Polyominomania", 66, 320, 440,
-            (255, 255, 200, 255), True, None))
+            (255, 255, 200, 255), True)
         # config list
         height = 350
         for item in self.list_items:
@@ -169,8 +269,8 @@ class MenuScene(Scene):
             name = item.replace(".json", "")[:32]
             if name != item.replace(".json", ""):
                 name += ".."
-            self.labels.append(util.make_label(
-                name, 10, 10, height, color, False, None))
+            self.labels.add(
+                name, 10, 10, height, color, False)
             height -= 10
         # if a valid config is found, show details about the config
         # else list the problem in red
@@ -180,71 +280,71 @@ class MenuScene(Scene):
             height = 350
             fs = 12
             # Basic information
-            self.labels.append(util.make_label(
-                "Information", 18, 270, height, head_color, False, None))
+            self.labels.add(
+                "Information", 18, 270, height, head_color, False)
             height -= fs
             for part_of_desc in util.split(self.config["description"], 40):
-                self.labels.append(util.make_label(
-                    part_of_desc, fs, 270, height, color, False, None))
+                self.labels.add(
+                    part_of_desc, fs, 270, height, color, False)
                 height -= fs
             color = (200, 255, 200, 255)
-            self.labels.append(util.make_label(
-                self.config_log, fs, 270, height, color, False, None))
+            self.labels.add(
+                self.config_log, fs, 270, height, color, False)
             height -= fs
             color = (255, 255, 255, 255)
             polyomino_string = "Polyominoes: {}".format(
                 " ".join(self.config["polyominoes"]))
             for part_of_poly in util.split(polyomino_string, 40):
-                self.labels.append(util.make_label(
+                self.labels.add(
                     part_of_poly,
-                    fs, 270, height, color, False, None))
+                    fs, 270, height, color, False)
                 height -= fs
-            self.labels.append(util.make_label(
+            self.labels.add(
                 "Lines needed per level: {}".format(
                     self.config["lines_per_level"]),
-                fs, 270, height, color, False, None))
+                fs, 270, height, color, False)
             height -= fs
-            self.labels.append(util.make_label(
+            self.labels.add(
                 "First level: {}".format(
                     self.config["first_level"]),
-                fs, 270, height, color, False, None))
+                fs, 270, height, color, False)
             height -= fs
-            self.labels.append(util.make_label(
+            self.labels.add(
                 "Next pieces: {}".format(
                     self.config["next_pieces"]),
-                fs, 270, height, color, False, None))
+                fs, 270, height, color, False)
             height -= fs
-            self.labels.append(util.make_label(
+            self.labels.add(
                 "Ghost piece: {}".format(
                     "visible" if self.config["ghost"] else "not visible"),
-                fs, 270, height, color, False, None))
+                fs, 270, height, color, False)
             height -= fs
-            self.labels.append(util.make_label(
+            self.labels.add(
                 "Grid size: {}x{}".format(
                     self.config["width"],
                     self.config["height"]),
-                fs, 270, height, color, False, None))
+                fs, 270, height, color, False)
             height -= 18
             # Scoring information
-            self.labels.append(util.make_label(
-                "Scoring", 18, 270, height, head_color, False, None))
+            self.labels.add(
+                "Scoring", 18, 270, height, head_color, False)
             height -= fs
             for field in ["polyomino", "softdrop", "harddrop", "level_up"]:
                 if self.config["scoring"][field] > 0:
-                    self.labels.append(util.make_label(
+                    self.labels.add(
                         "{} bonus: {}".format(
                             field.title().replace("_", " "),
                             self.config["scoring"][field]),
-                        fs, 270, height, color, False, None))
+                        fs, 270, height, color, False)
                     height -= fs
             lines_string = "lines:"
             for i in range(1, len(self.config["scoring"]["lines"]) + 1):
                 lines_string += " {}".format(
                     self.config["scoring"]["lines"][str(i)])
             for part_of_lines in util.split(lines_string, 40):
-                self.labels.append(util.make_label(
+                self.labels.add(
                     part_of_lines,
-                    fs, 270, height, color, False, None))
+                    fs, 270, height, color, False)
                 height -= fs
             lines_level_string = "This does not increase per level"
             limit = len(self.config["scoring"]["lines_per_level"]) + 1
@@ -252,9 +352,9 @@ class MenuScene(Scene):
                 if self.config["scoring"]["lines_per_level"][str(i)] > 0:
                     lines_level_string = "This does increase per level"
                     break
-            self.labels.append(util.make_label(
+            self.labels.add(
                 lines_level_string,
-                fs, 270, height, color, False, None))
+                fs, 270, height, color, False)
             height -= fs
         else:
             color = (255, 200, 200, 255)
@@ -262,13 +362,14 @@ class MenuScene(Scene):
             fs = 16
             # Show the error information
             for part_of_log in util.split(self.config_log, 36):
-                self.labels.append(util.make_label(
-                    part_of_log, fs, 270, height, color, False, None))
+                self.labels.add(
+                    part_of_log, fs, 270, height, color, False)
                 height -= fs
         # Select button instructions
-        self.labels.append(util.make_label(
+        self.labels.add(
             "Press Enter or Space to select",
-            18, 270, 10, (255, 255, 255, 255), False, None))
+            18, 270, 10, (255, 255, 255, 255), False)
+        self.labels.end()
 
     def key(self, name):
         if name == "select" and self.valid_config:
@@ -286,152 +387,32 @@ class MenuScene(Scene):
         self.make_labels()
 
     def loop(self, dt, keys):
-        if self.selected_in_list not in self.config_file:
-            self.config_file = os.path.join("modes", self.selected_in_list)
-            if os.path.isfile(self.config_file):
-                with open(self.config_file) as f:
-                    try:
-                        self.config = json.loads(f.read())
-                        self.valid_config, self.config_log = self.check_conf()
-                    except json.decoder.JSONDecodeError:
-                        self.config = {}
-                        self.valid_config = False
-                        self.config_log = "Invalid json"
-            else:
-                self.config = {}
-                self.valid_config = False
-                self.config_log = "Missing file"
-            self.make_labels()
-
-    def check_conf(self):
-        # root fields
-        root_fields = [
-            "description",
-            "polyominoes",
-            "scoring",
-            "lines_per_level",
-            "first_level",
-            "speed",
-            "speed_per_level",
-            "width",
-            "height",
-            "next_pieces",
-            "ghost",
-            "extra_spacing"
-        ]
-        for field in root_fields:
-            if field not in self.config:
-                return False, "Missing an essential field: {}".format(field)
-        # description
-        if not isinstance(self.config["description"], str):
-            return False, "Description must be a string"
-        # polyominoes
-        if len(self.config["polyominoes"]) == 0:
-            return False, "Zero polyomino sets"
-        largest_set = 0
-        for k, _ in self.config["polyominoes"].items():
-            if not k.isdigit():
-                return False, "Polyomino id must be a number"
-            number = int(k)
-            if number > largest_set:
-                largest_set = number
-            if number > 30 or number < 1:
-                return False, "Polyomino id must be between 0 and 31"
-            for field in ["next_piece", "colors"]:
-                if field not in self.config["polyominoes"][k]:
-                    return False, "Missing a polyomino field in number " \
-                                  "{}: {}".format(number, field)
-                if not isinstance(self.config["polyominoes"][k][field], str):
-                    return False, "Field {} in Polyomino {} must be a " \
-                                  "str".format(field, number)
-            acc = ["random", "jit", "bag"]
-            if self.config["polyominoes"][k]["next_piece"] not in acc:
-                return False, "next_piece in polyomino {} must be random" \
-                              ", bag or jit".format(number)
-            supported = polyomino.supported_color_schemes()
-            if self.config["polyominoes"][k]["colors"] not in supported:
-                return False, "color set in polyomino {} is not " \
-                              "a valid set, try original".format(number)
-            # chance
-            if "chance" not in self.config["polyominoes"][k]:
-                return False, "Missing a polyomino field in number " \
-                              "{}: chance".format(number)
-            if not isinstance(self.config["polyominoes"][k]["chance"], int):
-                return False, "chance in polyomino {} must be " \
-                              "an int".format(number)
-            if self.config["polyominoes"][k]["chance"] < 1:
-                return False, "chance in polyomino {} must be " \
-                              "at least 1".format(number)
-
-        # scoring
-        scoring_fields = [
-            "polyomino",
-            "lines",
-            "lines_per_level",
-            "softdrop",
-            "harddrop",
-            "level_up"
-        ]
-        for field in scoring_fields:
-            if field not in self.config["scoring"]:
-                return False, "Missing a scoring field: {}".format(field)
-        for field in ["polyomino", "softdrop", "harddrop", "level_up"]:
-            if not isinstance(self.config["scoring"][field], int):
-                return False, "Field {} in scoring must be an int".format(
-                    field)
-        for number in range(1, largest_set+1):
-            if (
-                str(number) in self.config["scoring"]["lines"] and
-                str(number) in self.config["scoring"]["lines_per_level"]
-            ):
-                if (
-                    isinstance(
-                        self.config["scoring"]["lines"][str(number)], int) and
-                    isinstance(
-                        self.config["scoring"]["lines_per_level"][str(number)],
-                        int)
-                ):
-                    continue
-            return False, "No scoring defined for {} line{}".format(
-                number,
-                "s" if number > 1 else "")
-        # next_pieces
-        if not isinstance(self.config["next_pieces"], int):
-            return False, "next_pieces must be an int"
-        if self.config["next_pieces"] > 4 or self.config["next_pieces"] < 0:
-            return False, "next_pieces must be at least 0 and not more than 4"
-        # ghost
-        if not isinstance(self.config["ghost"], bool):
-            return False, "ghost must be a bool"
-        # width and height
-        for field in ["height", "width"]:
-            if not isinstance(self.config[field], int):
-                return False, "{} must be an int".format(field)
-            if not int(self.config[field]) > largest_set:
-                return False, "{} must be above largest set size ({})".format(
-                    field,
-                    largest_set)
-        # extra_spacing
-        if not isinstance(self.config["extra_spacing"], bool):
-            return False, "extra_spacing must be a bool"
-        # other fields
-        other_fields = [
-            "lines_per_level",
-            "first_level",
-            "speed",
-            "speed_per_level"
-        ]
-        for field in other_fields:
-            if not isinstance(self.config[field], int):
-                return False, "{} must be an int".format(field)
-            if not int(self.config[field]) > 0:
-                return False, "{} must be above zero".format(field)
-        # looks good
-        return True, "Configuration looks good :)"
+        # look for added or changed modes every two seconds
+        self.loop_counter += 1
+        if self.loop_counter % int(2 / TICK) == 0:
+            self.catalog.refresh()
+        shown = (self.selected_in_list, self.catalog.version)
+        if shown == self.shown:
+            return
+        self.shown = shown
+        self.update_list()
+        mode = self.catalog.get(self.selected_in_list)
+        if mode is not None:
+            self.config = mode["config"]
+            self.valid_config = mode["valid"]
+            self.config_log = mode["log"]
+        else:
+            self.config = {}
+            self.valid_config = False
+            self.config_log = "Missing file"
+            if not self.catalog.scanned:
+                self.config_log = "Loading modes"
+            elif self.selected_in_list in self.catalog.names():
+                self.config_log = "Loading mode"
+        self.make_labels()
 
     def draw(self):
-        for label in self.labels:
-            label.draw()
+        self.labels.draw()
 
     def clear(self):
         pass
@@ -439,56 +420,51 @@ class MenuScene(Scene):
 
 class GameScene(Scene):
 
-    def __init__(self, config):
+    def __init__(
+            self, config, seed=None, system_random=False,
+            batched_board=False, autoplay=False, playback=None):
         super().__init__()
         self.config = config
+        # recorded game to show, its moves are made instead of the inputs
+        self.playback = playback
+        self.next_move = 0
+        if self.playback is not None:
+            seed = self.playback.seed
+            system_random = False
+            autoplay = False
+        # random number generator, seeded to make the game reproducible
+        self.seed = None
+        if not system_random:
+            self.seed = seed
+            if self.seed is None:
+                self.seed = SystemRandom().getrandbits(32)
+        self.rng = polyomino.make_rng(self.seed, system_random)
+        # game rules, this scene only shows the state of the engine
+        self.engine = engine.Engine(config, self.rng)
         self.name = "game"
         self.desired_scene = "game"
         self.ready = False
         self.entities = []
         self.batch = pyglet.graphics.Batch()
-        self.block_sizes = []
-        self.blocks = {}
-        self.bags = {}
-        self.score = 0
-        self.current_level = config["first_level"]
         self.paused = True
         self.pause_text = "Generating polyominoes"
         self.init_blocks_text = ""
-        self.pause_label = util.make_label(
-            self.pause_text,
-            32, 320, 240, (255, 255, 255, 255), True, None)
-        self.init_blocks_label = util.make_label(
-            "", 12, 320, 200, (255, 255, 255, 255), True, None)
+        self.pause_labels = util.LabelPool()
         self.shade = Shade((30, 30, 30, 150))
         self.entities.append(self.shade)
-        self.lines = 0
-        # labels
-        height = 470
-        fs = 14
-        self.labels = {}
-        for label in ["score", "lines", "level"]:
-            label_config = [
-                fs, 540, height, (255, 255, 255, 255), False, self.batch
-            ]
-            self.labels["text_{}".format(label)] = util.make_label(
-                label.title(), *label_config)
-            self.labels["text_{}".format(label)].original_pos = [540, height]
-            self.labels["text_{}".format(label)].original_size = fs
-            height -= fs
-            label_config = [
-                fs, 540, height, (255, 255, 255, 255), False, self.batch
-            ]
-            self.labels[label] = util.make_label("", *label_config)
-            self.labels[label].original_pos = [540, height]
-            self.labels[label].original_size = fs
-            height -= fs
-        # block grid
+        # labels, drawn together with the entities
+        self.labels = util.LabelPool(self.batch)
+        # block grid, with the locked block at each position or None
         self.block_grid = []
         for i in range(0, config["height"]):
             self.block_grid.append([])
             for _ in range(0, config["width"]):
                 self.block_grid[i].append(None)
+        self.current_blocks = []
+        self.current_color = None
+        self.ghost_blocks = []
+        self.ghost_color = None
+        self.previews = []
         # graphical grid size
         max_width = 540
         max_height = 480
@@ -511,390 +487,330 @@ class GameScene(Scene):
         wall["width"] = width
         wall["height"] = int(self.grid_size)
         self.entities.append(Wall(wall, self.batch))
-        # initial speed
-        spl = config["speed_per_level"]
-        speed = 10 / config["speed"] + spl * (self.current_level - 1)
-        pyglet.clock.schedule_interval(self.game_loop, speed)
+        # board renderer, when the blocks are not drawn as separate sprites
+        self.renderer = None
+        if batched_board:
+            self.renderer = BoardRenderer(
+                self.grid_size, config["extra_spacing"], self.batch)
+        self.stack_changed = True
+        # computer player, with the moves it still plans to make
+        self.autoplay = None
+        if autoplay:
+            self.autoplay = bot.Bot()
+        self.plan = []
+        # every move is recorded with the tick it was made at,
+        # only games with a seed can be played again
+        self.tick = 0
+        self.recorder = None
+        if self.seed is not None and self.playback is None:
+            self.recorder = replay.Recorder(self.seed, config)
+        self.replay_path = None
+        # time since the piece last fell a row
+        self.fall_time = 0.0
         # loop counter
         self.loop_counter = 0
+        self.make_labels()
 
     def make_labels(self):
-        self.labels["score"].text = str(self.score)
-        self.labels["lines"].text = str(self.lines)
-        self.labels["level"].text = str(self.current_level)
-        self.pause_label = util.make_label(
-            self.pause_text,
-            32, 320, 240, (255, 255, 255, 255), True, None)
-        self.init_blocks_label = util.make_label(
-            self.init_blocks_text,
-            12, 320, 200, (255, 255, 255, 255), True, None)
-        for name, label in self.labels.items():
-            pos = util.res(*label.original_pos)
-            label.x = pos["w"]
-            label.y = pos["h"]
-            label.font_size = pos["wr"] * label.original_size
-            self.labels[name] = label
+        height = 470
+        fs = 14
+        values = {
+            "score": self.engine.score,
+            "lines": self.engine.lines,
+            "level": self.engine.current_level
+        }
+        for label, value in values.items():
+            self.labels.label(
+                "text_{}".format(label), label.title(),
+                fs, 540, height, (255, 255, 255, 255), False)
+            height -= fs
+            self.labels.label(
+                label, str(value),
+                fs, 540, height, (255, 255, 255, 255), False)
+            height -= fs
+        self.pause_labels.label(
+            "pause", self.pause_text,
+            32, 320, 240, (255, 255, 255, 255), True)
+        self.pause_labels.label(
+            "init_blocks", self.init_blocks_text,
+            12, 320, 200, (255, 255, 255, 255), True)
+
+    def act(self, action):
+        if self.recorder is not None:
+            self.recorder.record(self.tick, action)
+        return self.engine.act(action)
+
+    def start(self):
+        self.act("start")
+        self.sync()
+        self.pause_text = "PAUSED"
+        self.init_blocks_text = ""
 
     def key(self, name):
         if not self.ready:
             return
+        if self.playback is not None:
+            # a replay can only be paused, the moves are already known
+            if name == "back" and self.pause_text == "PAUSED":
+                self.paused = not self.paused
+            return
         if name == "select" and self.pause_text != "PAUSED":
-            self.init_block_queue()
-            self.pause_text = "PAUSED"
-            self.init_blocks_text = ""
+            self.start()
             self.paused = False
             return
         if name == "back":
             if self.pause_text != "PAUSED":
-                self.init_block_queue()
-                self.pause_text = "PAUSED"
-                self.init_blocks_text = ""
+                self.start()
             self.paused = not self.paused
         if self.paused:
             return
         self.loop_counter = 0
         if name == "right":
-            self.move("right")
+            self.act("right")
         if name == "left":
-            self.move("left")
+            self.act("left")
         if name == "up":
-            self.rotate()
+            self.act("rotate")
         if name == "down":
-            if self.drop_piece():
-                self.score += self.config["scoring"]["softdrop"]
+            self.act("down")
         if name == "select":
-            while self.drop_piece():
-                self.score += self.config["scoring"]["harddrop"]
+            self.act("drop")
         if name == "other":
-            self.rotate(False)
+            self.act("rotate_ccw")
+        self.sync()
 
     def loop(self, dt, keys):
         self.make_labels()
         self.loop_counter += 1
         lc = self.loop_counter
+        if not self.paused:
+            self.tick += 1
+        if self.playback is not None:
+            if self.ready and self.pause_text != "PAUSED":
+                # the recorded start is the first move
+                self.start()
+                self.paused = False
+                self.next_move = 1
+            elif not self.paused:
+                self.playback_moves()
+            return
+        if self.autoplay is not None and self.ready:
+            if self.pause_text != "PAUSED":
+                self.key("select")
+            elif not self.paused and lc % 2 == 0:
+                self.autoplay_move()
         if self.paused:
             return
-        if keys["right"] and lc > 30 and lc % 3 == 0:
-            self.move("right")
-        if keys["left"] and lc > 30 and lc % 3 == 0:
-            self.move("left")
-        if keys["down"] and lc > 10 and lc % 2 == 0:
-            if self.drop_piece():
-                self.score += self.config["scoring"]["softdrop"]
+        if keys["right"] and lc > DAS and lc % ARR == 0:
+            self.act("right")
+        if keys["left"] and lc > DAS and lc % ARR == 0:
+            self.act("left")
+        if keys["down"] and lc > SOFT_DROP_DELAY and lc % SOFT_DROP_RATE == 0:
+            self.act("down")
+        self.gravity(dt)
+        self.sync()
+
+    def autoplay_move(self):
+        if not self.plan:
+            self.plan = self.autoplay.plan(self.engine)
+        action = self.plan.pop(0)
+        if not self.act(action):
+            self.plan = []
+        self.sync()
+
+    def playback_moves(self):
+        # make all the recorded moves up to the current tick
+        moves = self.playback.moves
+        while self.next_move < len(moves):
+            tick, action = moves[self.next_move]
+            if tick > self.tick:
+                break
+            self.engine.act(action)
+            self.next_move += 1
+        self.sync()
+        if self.next_move >= len(moves) and not self.engine.game_over:
+            # recorded before the game was over
+            self.desired_scene = "menu"
 
     def draw(self):
+        # board
+        if self.renderer is not None:
+            self.draw_board()
         # entities
         self.batch.draw()
-        for e in self.entities:
-            e.fix_pos()
         # pause overlay
         if self.paused:
             self.shade.draw()
-            self.pause_label.draw()
-            self.init_blocks_label.draw()
-
-    def game_loop(self, dt):
-        if self.paused:
+            self.pause_labels.draw()
+
+    def draw_board(self):
+        if self.stack_changed:
+            self.renderer.update("stack", [
+                (x, y, color)
+                for y, row in enumerate(self.engine.colors)
+                for x, color in enumerate(row)
+                if color is not None])
+            self.stack_changed = False
+        if self.config["ghost"] and self.engine.current:
+            ghost_color = (*self.engine.current_color[0:3], 100)
+            self.renderer.update("ghost", [
+                (x, y, ghost_color) for x, y in self.engine.ghost()])
+        self.renderer.update("current", [
+            (x, y, self.engine.current_color)
+            for x, y in self.engine.current])
+
+    def gravity(self, dt):
+        # the piece falls a row each interval of the current level,
+        # locking when it can't fall further
+        self.fall_time += dt
+        while self.fall_time >= self.engine.interval:
+            self.fall_time -= self.engine.interval
+            if self.engine.game_over:
+                break
+            self.act("gravity")
+
+    def sync(self):
+        # follow the changes of the engine
+        for event in self.engine.pop_events():
+            if event[0] == "lock":
+                self.lock_blocks(event[1])
+            elif event[0] == "lines":
+                self.remove_lines(event[1])
+            elif event[0] == "piece":
+                self.preview_pieces()
+                self.plan = []
+            elif event[0] == "game_over":
+                self.desired_scene = "score"
+                if self.playback is not None:
+                    self.desired_scene = "menu"
+        if self.renderer is not None:
             return
-        self.drop_piece()
-
-    def rotate(self, clockwise=True):
-        rotated = polyomino.rotate(self.current_block, clockwise)
-        left = self.config["width"]
-        top = self.config["height"]
-        for e in self.entities:
-            if isinstance(e, CurrentBlock):
-                if e.grid_y < top:
-                    top = e.grid_y
-                if e.grid_x < left:
-                    left = e.grid_x
-        new_blocks = []
-        shift_x, shift_y = polyomino.fix_rotation_position(
-            self.current_block, rotated)
-        for y in range(0, len(rotated)):
-            for x in range(0, len(rotated[y])):
-                if rotated[y][x] == 1:
-                    new_x = left + x + shift_x
-                    new_y = top + y + shift_y
-                    if self.check_grid(new_x, new_y) is not None:
-                        return
-                    if new_x >= self.config["width"]:
-                        return
-                    if new_y >= self.config["height"]:
-                        return
-                    if new_x < 0 or new_y < 0:
-                        return
-                    new_blocks.append(CurrentBlock(
-                        new_x, new_y, self.current_color,
-                        self.grid_size, self.batch,
-                        self.config["extra_spacing"]))
-        self.entities = [
-            e for e in self.entities if not isinstance(e, CurrentBlock)]
-        for block in new_blocks:
-            self.entities.append(block)
-        self.current_block = rotated
+        self.current_blocks = self.place_blocks(
+            CurrentBlock,
+            self.current_blocks,
+            self.engine.current,
+            self.current_color,
+            self.engine.current_color)
+        self.current_color = self.engine.current_color
         if self.config["ghost"]:
-            self.update_ghost()
-
-    def move(self, direction):
-        if direction == "right":
-            movement = 1
-        elif direction == "left":
-            movement = -1
-        can_move = True
-        for e in self.entities:
-            if isinstance(e, CurrentBlock):
-                if e.grid_x + movement == self.config["width"]:
-                    can_move = False
-                    break
-                if e.grid_x + movement < 0:
-                    can_move = False
-                    break
-                if self.check_grid(e.grid_x + movement, e.grid_y) is not None:
-                    can_move = False
-                    break
-        if can_move:
-            for e in self.entities:
-                if isinstance(e, CurrentBlock):
-                    e.update(e.grid_x + movement, e.grid_y)
-            if self.config["ghost"]:
-                self.update_ghost()
-            return True
-        return False
-
-    def drop_ghost(self):
-        can_fall = True
-        for e in self.entities:
-            if isinstance(e, GhostBlock):
-                if e.grid_y + 1 == self.config["height"]:
-                    can_fall = False
-                    break
-                if self.check_grid(e.grid_x, e.grid_y+1) is not None:
-                    can_fall = False
-                    break
-        if can_fall:
-            for e in self.entities:
-                if isinstance(e, GhostBlock):
-                    e.update(e.grid_x, e.grid_y+1)
-            return True
-        return False
-
-    def drop_piece(self):
-        can_fall = True
-        for e in self.entities:
-            if isinstance(e, CurrentBlock):
-                if e.grid_y + 1 == self.config["height"]:
-                    can_fall = False
-                    break
-                if self.check_grid(e.grid_x, e.grid_y+1) is not None:
-                    can_fall = False
-                    break
-        if can_fall:
-            for e in self.entities:
-                if isinstance(e, CurrentBlock):
-                    e.update(e.grid_x, e.grid_y+1)
-            return True
-        self.score += self.config["scoring"]["polyomino"]
-        self.next_piece()
-        self.process_lines()
-        return False
-
-    def process_lines(self):
-        found_line = True
-        number_of_lines = 0
-        while found_line:
-            found_line = False
-            for line in range(0, self.config["height"]):
-                block_count = 0
-                for col in range(0, self.config["width"]):
-                    if self.check_grid(col, line) is not None:
-                        block_count += 1
-                if block_count != self.config["width"]:
-                    continue
-                found_line = True
-                number_of_lines += 1
-                remove_blocks = []
-                for e in self.entities:
-                    if type(e) == Block:
-                        if e.grid_y == line:
-                            remove_blocks.append(e)
-                        elif e.grid_y < line:
-                            e.update(e.grid_x, e.grid_y+1)
-                self.entities = list(
-                    set(self.entities).difference(set(remove_blocks)))
-        self.update_score_by_lines(number_of_lines)
-        if self.config["ghost"]:
-            self.update_ghost()
-
-    def check_grid(self, x, y):
-        for e in self.entities:
-            if type(e) == Block:
-                if e.grid_x == x and e.grid_y == y:
-                    return e
-        return None
-
-    def next_level(self):
-        self.score += self.config["scoring"]["level_up"]
-        self.current_level += 1
-        pyglet.clock.unschedule(self.game_loop)
-        spl = self.config["speed_per_level"]
-        speed = 10 / (self.config["speed"] + spl * (self.current_level - 1))
-        pyglet.clock.schedule_interval(self.game_loop, speed)
-
-    def update_score_by_lines(self, n):
-        if n == 0:
+            self.ghost_blocks = self.place_blocks(
+                GhostBlock,
+                self.ghost_blocks,
+                self.engine.ghost(),
+                self.ghost_color,
+                self.engine.current_color)
+            self.ghost_color = self.engine.current_color
+
+    def place_blocks(self, cls, blocks, squares, old_color, color):
+        # move the blocks of the previous position if they still fit
+        if len(blocks) == len(squares) and old_color == color:
+            for block, (x, y) in zip(blocks, squares):
+                if block.grid_x != x or block.grid_y != y:
+                    block.update(x, y)
+            return blocks
+        for block in blocks:
+            block.delete()
+        self.entities = [e for e in self.entities if not isinstance(e, cls)]
+        blocks = [
+            cls(
+                x,
+                y,
+                color,
+                self.grid_size,
+                self.batch,
+                self.config["extra_spacing"])
+            for x, y in squares]
+        self.entities.extend(blocks)
+        return blocks
+
+    def lock_blocks(self, locked):
+        self.stack_changed = True
+        if self.renderer is not None:
             return
-        self.lines += n
-        required_level = int(self.lines / self.config["lines_per_level"])
-        required_level -= self.config["first_level"]
-        required_level += 2
-        while required_level > self.current_level:
-            self.next_level()
-        base_score = self.config["scoring"]["lines"][str(n)]
-        level_score = self.config["scoring"]["lines_per_level"][str(n)]
-        self.score += base_score + level_score * (self.current_level - 1)
-
-    def new_piece(self):
-        size = SystemRandom().choice(self.block_sizes)
-        if size in self.bags:
-            length = len(self.bags[size])
-            if length == 0:
-                self.bags[size] = self.blocks[size][:]
-                length = len(self.bags[size])
-            return self.bags[size].pop(SystemRandom().randrange(length))
-        if size in self.blocks:
-            return SystemRandom().choice(self.blocks[size])
-        return polyomino.generate(size)
-
-    def init_block_queue(self):
-        self.block_queue = []
-        self.block_queue_colors = []
-        for _ in range(0, self.config["next_pieces"]):
-            new_piece = self.new_piece()
-            self.block_queue.append(new_piece)
-            scheme = self.config["polyominoes"][str(sum(sum(
-                new_piece, []), 0))]["colors"]
-            self.block_queue_colors.append(polyomino.color(new_piece, scheme))
-        self.next_piece()
-
-    def next_piece(self):
-        new_piece = self.new_piece()
-        self.block_queue.append(new_piece)
-        scheme = self.config["polyominoes"][str(sum(sum(
-            new_piece, []), 0))]["colors"]
-        self.block_queue_colors.append(polyomino.color(new_piece, scheme))
-        self.current_block = self.block_queue.pop(0)
-        self.current_color = self.block_queue_colors.pop(0)
-        block_width = len(self.current_block)
-        width = int(self.config["width"] / 2 + 1 - block_width / 2)
-        old_blocks = [e for e in self.entities if isinstance(e, CurrentBlock)]
-        for block in old_blocks:
-            if block.grid_y < 3:
-                self.desired_scene = "score"
-                return
-            self.entities.append(Block(
-                block.grid_x,
-                block.grid_y,
-                block.stored_color,
+        for x, y, color in locked:
+            block = Block(
+                x,
+                y,
+                color,
                 self.grid_size,
                 self.batch,
-                self.config["extra_spacing"]))
-        self.entities = [
-            e for e in self.entities if not isinstance(e, CurrentBlock)]
-        for y in range(0, len(self.current_block)):
-            for x in range(0, len(self.current_block[y])):
-                if self.current_block[y][x] == 1:
-                    block = CurrentBlock(
-                        width + x,
-                        y,
-                        self.current_color,
-                        self.grid_size,
-                        self.batch,
-                        self.config["extra_spacing"])
-                    self.entities.append(block)
-        self.preview_pieces()
-        if self.config["ghost"]:
-            self.update_ghost()
-
-    def update_ghost(self):
-        self.entities = [
-            e for e in self.entities if not isinstance(e, GhostBlock)]
-        for e in self.entities:
-            if isinstance(e, CurrentBlock):
-                block = GhostBlock(
-                    e.grid_x,
-                    e.grid_y,
-                    self.current_color,
-                    self.grid_size,
-                    self.batch,
-                    self.config["extra_spacing"])
-                self.entities.append(block)
-        while self.drop_ghost():
-            pass
+                self.config["extra_spacing"])
+            self.block_grid[y][x] = block
+            self.entities.append(block)
+
+    def remove_lines(self, lines):
+        self.stack_changed = True
+        if self.renderer is not None:
+            return
+        # move every remaining row down by the number of lines below it
+        removed = set()
+        number_of_lines = 0
+        for line in range(self.config["height"] - 1, -1, -1):
+            if line in lines:
+                number_of_lines += 1
+                for block in self.block_grid[line]:
+                    if block is not None:
+                        block.delete()
+                        removed.add(block)
+            elif number_of_lines:
+                for block in self.block_grid[line]:
+                    if block is not None:
+                        block.update(block.grid_x, line + number_of_lines)
+        self.entities = [e for e in self.entities if e not in removed]
+        self.block_grid = [
+            [None] * self.config["width"]
+            for _ in range(0, number_of_lines)
+        ] + [
+            self.block_grid[line]
+            for line in range(0, self.config["height"])
+            if line not in lines]
 
     def preview_pieces(self):
-        self.entities = [
-            e for e in self.entities if not isinstance(e, PreviewBlock)]
-        base_y = 350
-        number = 0
-        smaller_grid = int(80 / max(self.block_sizes))
-        for block in self.block_queue:
-            for y in range(0, len(block)):
-                for x in range(0, len(block[y])):
-                    if block[y][x] == 1:
-                        self.entities.append(PreviewBlock(
-                            {
-                                "x": 540 + x * smaller_grid,
-                                "y": base_y - y * smaller_grid,
-                                "width": smaller_grid - 1,
-                                "height": smaller_grid - 1,
-                                "color": self.block_queue_colors[number]
-                            }, self.batch))
-            number += 1
-            base_y -= 80
+        # a sprite for each place in the queue, which only gets a new image
+        smaller_grid = int(80 / self.engine.largest_size)
+        queue = zip(self.engine.block_queue, self.engine.block_queue_colors)
+        for number, (piece, color) in enumerate(queue):
+            if number < len(self.previews):
+                self.previews[number].show(piece, color)
+                continue
+            preview = PreviewPiece(
+                540, 350 - number * 80, piece, color, smaller_grid, self.batch)
+            self.previews.append(preview)
+            self.entities.append(preview)
 
     def init_blocks(self):
         time.sleep(1)
-        for k, v in self.config["polyominoes"].items():
-            for _ in range(0, v["chance"]):
-                self.block_sizes.append(int(k))
-            if v["next_piece"] != "jit":
-                self.blocks[int(k)] = self.generate_all_polyominoes(int(k))
-            if v["next_piece"] == "bag":
-                self.bags[int(k)] = self.blocks[int(k)][:]
+        self.engine.load_pieces(self.generation_progress)
         self.pause_text = "Ready to go"
         self.init_blocks_text = "Press Enter or Space to start"
         self.ready = True
 
-    def generate_all_polyominoes(self, number):
-        pieces = []
-        while len(pieces) < polyomino.A000988[number]:
-            piece = polyomino.generate(number)
-            if not polyomino.duplicate(pieces, piece):
-                message = "Number {}: Generated {} out " \
-                          "of {} so far, normally takes {}".format(
-                              number,
-                              len(pieces),
-                              polyomino.A000988[number],
-                              polyomino.install_times(number))
-                self.init_blocks_text = message
-                pieces.append(piece)
-        return pieces
+    def generation_progress(self, number, count):
+        message = "Number {}: Generated {} out " \
+                  "of {} so far, normally takes {}".format(
+                      number,
+                      count,
+                      polyomino.A000988[number],
+                      polyomino.install_times(number))
+        self.init_blocks_text = message
 
     def clear(self):
-        pyglet.clock.unschedule(self.game_loop)
         self.batch.invalidate()
+        if self.recorder is not None and self.recorder.count:
+            self.replay_path = self.recorder.save()
 
 
 class ScoreScene(Scene):
 
-    def __init__(self, config, score, lines):
+    def __init__(self, config, score, lines, seed, replay_path=None):
         super().__init__()
         self.name = "score"
         self.desired_scene = "score"
         self.config = config
         self.score = score
         self.lines = lines
+        self.seed = seed
+        self.replay_path = replay_path
         self.generate_config_string()
         self.highscores = {}
         self.chars = [e for e in " ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"]
@@ -936,69 +852,70 @@ class ScoreScene(Scene):
             self.highscores.pop(k)
         # loop counter
         self.loop_counter = 0
-        self.labels = []
+        self.labels = util.LabelPool()
         self.make_labels()
 
     def make_labels(self):
-        self.labels = []
+        self.labels.begin()
         for c in range(0, 9):
             color = (255, 255, 255, 255)
             if self.writer_index == c:
                 color = (100, 255, 100, 255)
-            self.labels.append(util.make_label(
+            self.labels.add(
                 self.chars[self.character_ids[c]].replace(" ", "."),
-                26, 20+c*26, 10, color, False, None))
+                26, 20+c*26, 10, color, False)
         color = (255, 255, 255, 255)
         if self.writer_index == 9:
             color = (100, 255, 100, 255)
-        self.labels.append(util.make_label(
+        self.labels.add(
             "OK",
-            26, 260, 10, color, False, None))
+            26, 260, 10, color, False)
         no_highscores = False
         if self.config_string not in self.highscores:
             no_highscores = True
         elif len(self.highscores[self.config_string]) == 0:
             no_highscores = True
         if no_highscores:
-            self.labels.append(util.make_label(
+            self.labels.add(
                 "No Highscores for this config yet!",
                 12,
                 320,
                 400,
-                (255, 255, 255, 255), True, None))
+                (255, 255, 255, 255), True)
         else:
             number = 1
             height = 400
             fs = 12
-            self.labels.append(util.make_label(
+            self.labels.add(
                 "pos{}name{}score{}lines{}date".format(
                     " "*6,
                     " "*16,
                     " "*11,
                     " "*22
-                ), fs, 16, height, (255, 255, 255, 255), False, None))
+                ), fs, 16, height, (255, 255, 255, 255), False)
             height -= fs
             scores = self.highscores[self.config_string]
             for player_score in sorted(scores,
                                        key=lambda k: k["score"],
                                        reverse=True):
-                self.labels.append(util.make_label(
+                self.labels.add(
                     "{} {} {} {} {}".format(
                         str(number).rjust(2, " "),
                         str(player_score["name"]).rjust(9, " "),
                         str(player_score["score"]).rjust(20, " "),
                         str(player_score["lines"]).rjust(15, " "),
                         str(self.dt(player_score["date"])).rjust(25, " ")
-                    ), fs, 24, height, (255, 255, 255, 255), False, None))
+                    ), fs, 24, height, (255, 255, 255, 255), False)
                 height -= fs
                 number += 1
                 if number > 30:
                     break
-        self.labels.append(util.make_label(
-            "Highscores", 40, 320, 440, (255, 255, 255, 255), True, None))
-        self.labels.append(util.make_label(
+        self.labels.add(
+            "Highscores", 40, 320, 440, (255, 255, 255, 255), True)
+        self.labels.add(
             "Score: {}".format(self.score),
-            26, 320, 10, (255, 255, 255, 255), False, None))
+            26, 320, 10, (255, 255, 255, 255), False)
+        self.labels.end()
 
     def key(self, name):
         self.loop_counter = 0
@@ -1052,8 +969,7 @@ class ScoreScene(Scene):
             self.make_labels()
 
     def draw(self):
-        for label in self.labels:
-            label.draw()
+        self.labels.draw()
 
     def generate_config_string(self):
         output = ""
@@ -1079,12 +995,17 @@ class ScoreScene(Scene):
     def add_highscore(self, name):
         if self.config_string not in self.highscores:
             self.highscores[self.config_string] = []
-        self.highscores[self.config_string].append({
+        highscore = {
             "name": name,
             "date": self.ut(datetime.datetime.utcnow()),
             "score": self.score,
             "lines": self.lines,
-        })
+        }
+        if self.seed is not None:
+            highscore["seed"] = self.seed
+        if self.replay_path is not None:
+            highscore["replay"] = self.replay_path
+        self.highscores[self.config_string].append(highscore)
         with open("highscores.json", "w") as f:
             f.write(json.dumps(self.highscores, indent=4))
         self.desired_scene = "menu"
@@ -1101,31 +1022,39 @@ class ScoreScene(Scene):
 
 class Entity(pyglet.sprite.Sprite, metaclass=abc.ABCMeta):
 
+    # textures shared by all entities with the same color and size
+    textures = {}
+    # entities of a higher layer are drawn over those of a lower layer,
+    # instead of in an order that depends on their textures
+    layers = [pyglet.graphics.OrderedGroup(n) for n in range(0, 3)]
+    layer = 0
+
     def __init__(self, p, batch):
         """ Base Entity Class
 
         A superclass for all entities.
         Can be customised using the following properties:
-        x, y, sprite/color, width, height
+        x, y, sprite/image/color, width, height
         """
         if "sprite" in p:
             sprite = pyglet.image.load(p["sprite"])
+        elif "image" in p:
+            sprite = p["image"]
         else:
-            sprite = pyglet.image.create(
-                p["width"],
-                p["height"],
-                pyglet.image.SolidColorImagePattern(p["color"]))
+            sprite = self.texture(p["color"], p["width"], p["height"])
         self.actual_size = [p["width"], p["height"]]
-        self.pos = [p["x"], p["y"]]
-        super().__init__(sprite, x=p["x"], y=p["y"], batch=batch)
-        self.fix_pos()
+        super().__init__(
+            sprite, x=p["x"], y=p["y"], batch=batch,
+            group=Entity.layers[self.layer])
 
-    def fix_pos(self):
-        pos = util.res(*self.pos)
-        self.x = pos["w"]
-        self.y = pos["h"]
-        self.image.width = self.actual_size[0] * pos["wr"]
-        self.image.height = self.actual_size[1] * pos["hr"]
+    def texture(self, color, width, height):
+        key = (tuple(color), width, height)
+        if key not in Entity.textures:
+            Entity.textures[key] = pyglet.image.create(
+                width,
+                height,
+                pyglet.image.SolidColorImagePattern(key[0])).get_texture()
+        return Entity.textures[key]
 
 
 class Block(Entity):
@@ -1144,50 +1073,189 @@ class Block(Entity):
         properties["x"], properties["y"] = self.grid_to_screen(x, y)
         properties["width"] = int(self.grid_size)
         properties["height"] = int(self.grid_size)
+        if self.spacing_between:
+            properties["width"] = max(1, properties["width"] - 2)
+            properties["height"] = max(1, properties["height"] - 2)
         super().__init__(properties, batch)
-        self.fix_pos()
 
     def grid_to_screen(self, x, y):
         screen_x = int(self.grid_size) + x*int(self.grid_size)
         screen_y = 480 - (y+1)*self.grid_size
+        # spaced blocks are a pixel smaller on each side
+        if self.spacing_between:
+            return int(screen_x) + 1, int(screen_y) + 1
         return int(screen_x), int(screen_y)
 
     def update(self, x, y):
         self.grid_x = x
         self.grid_y = y
-        tempx, tempy = self.grid_to_screen(x, y)
-        self.pos = self.grid_to_screen(x, y)
-
-    def fix_pos(self):
-        if self.spacing_between:
-            pos = util.res(self.pos[0] + 1, self.pos[1] + 1)
-            self.x = pos["w"]
-            self.y = pos["h"]
-            self.image.width = (self.actual_size[0] - 2) * pos["wr"]
-            self.image.height = (self.actual_size[1] - 2) * pos["hr"]
-        else:
-            pos = util.res(*self.pos)
-            self.x = pos["w"]
-            self.y = pos["h"]
-            self.image.width = self.actual_size[0] * pos["wr"]
-            self.image.height = self.actual_size[1] * pos["hr"]
+        self.position = self.grid_to_screen(x, y)
 
 
 class CurrentBlock(Block):
-    pass
 
+    layer = 2
+
+
+class PreviewPiece(Entity):
+
+    # images of the pieces shown before, by key, color and square size
+    images = collections.OrderedDict()
+    max_images = 256
+
+    def __init__(self, x, y, piece, color, gs, batch):
+        """ Preview Entity
+
+        A queued piece, drawn as a single sprite with a cached image.
+        The top left square of the piece is at the given position.
+        """
+        self.grid_size = gs
+        self.top = y
+        self.piece = piece
+        self.stored_color = color
+        image = self.piece_image(piece, color, gs)
+        properties = {
+            "image": image,
+            "x": x,
+            "y": y - image.height + gs,
+            "width": image.width,
+            "height": image.height
+        }
+        super().__init__(properties, batch)
 
-class PreviewBlock(Entity):
-    pass
+    def show(self, piece, color):
+        if piece == self.piece and color == self.stored_color:
+            return
+        self.piece = piece
+        self.stored_color = color
+        self.image = self.piece_image(piece, color, self.grid_size)
+        self.y = self.top - self.image.height + self.grid_size
+
+    def piece_image(self, piece, color, gs):
+        key = (piece.key, tuple(color), gs)
+        if key in PreviewPiece.images:
+            PreviewPiece.images.move_to_end(key)
+            return PreviewPiece.images[key]
+        # squares of the grid size minus one, image rows start at the bottom
+        width = piece.width * gs
+        height = piece.height * gs
+        pixels = bytearray(width * height * 4)
+        line = bytes(key[1]) * (gs - 1)
+        for x, y in piece.cells:
+            bottom = (piece.height - 1 - y) * gs
+            for row in range(bottom, bottom + gs - 1):
+                start = (row * width + x * gs) * 4
+                pixels[start:start + len(line)] = line
+        image = pyglet.image.ImageData(
+            width, height, "RGBA", bytes(pixels)).get_texture()
+        # the projection scales the image, keep the gaps between the squares
+        # sharp instead of blending them with the squares
+        pyglet.gl.glBindTexture(image.target, image.id)
+        for name in [
+                pyglet.gl.GL_TEXTURE_MAG_FILTER,
+                pyglet.gl.GL_TEXTURE_MIN_FILTER]:
+            pyglet.gl.glTexParameteri(
+                image.target, name, pyglet.gl.GL_NEAREST)
+        PreviewPiece.images[key] = image
+        if len(PreviewPiece.images) > PreviewPiece.max_images:
+            PreviewPiece.images.popitem(last=False)
+        return image
 
 
 class GhostBlock(Block):
 
+    layer = 1
+
     def __init__(self, x, y, color, gs, batch, extra_spacing):
         color = (*color[0:3], 100)
         super().__init__(x, y, color, gs, batch, extra_spacing)
 
 
+class BlendGroup(pyglet.graphics.OrderedGroup):
+
+    def set_state(self):
+        pyglet.gl.glEnable(pyglet.gl.GL_BLEND)
+        pyglet.gl.glBlendFunc(
+            pyglet.gl.GL_SRC_ALPHA, pyglet.gl.GL_ONE_MINUS_SRC_ALPHA)
+
+    def unset_state(self):
+        pyglet.gl.glDisable(pyglet.gl.GL_BLEND)
+
+
+class ScaledGroup(pyglet.graphics.Group):
+
+    def __init__(self, scale, parent=None):
+        """ Scaled Group
+
+        Draws its children in window pixels instead of layout coordinates,
+        undoing the scale of the letterbox projection.
+        """
+        super().__init__(parent)
+        self.scale = scale
+
+    def set_state(self):
+        pyglet.gl.glPushMatrix()
+        pyglet.gl.glScalef(1 / self.scale, 1 / self.scale, 1)
+
+    def unset_state(self):
+        pyglet.gl.glPopMatrix()
+
+
+class BoardRenderer:
+
+    def __init__(self, gs, extra_spacing, batch):
+        """ Board Renderer
+
+        Draws the squares of the board as colored quads in a few vertex lists,
+        one for the stack, one for the ghost and one for the current piece.
+        A list is only rebuilt when its squares change.
+        """
+        self.grid_size = int(gs)
+        self.spacing_between = extra_spacing
+        self.batch = batch
+        self.groups = {
+            "stack": BlendGroup(0),
+            "ghost": BlendGroup(1),
+            "current": BlendGroup(2)
+        }
+        self.squares = {name: [] for name in self.groups}
+        self.vertex_lists = {}
+
+    def update(self, name, squares):
+        if squares != self.squares[name]:
+            self.squares[name] = squares
+            self.build(name)
+
+    def build(self, name):
+        if name in self.vertex_lists:
+            self.vertex_lists.pop(name).delete()
+        squares = self.squares[name]
+        if not squares:
+            return
+        gs = self.grid_size
+        size = gs
+        inset = 0
+        if self.spacing_between:
+            size = max(1, gs - 2)
+            inset = 1
+        vertices = []
+        colors = []
+        for x, y, color in squares:
+            left = gs + x * gs + inset
+            bottom = 480 - (y + 1) * gs + inset
+            right = left + size
+            top = bottom + size
+            vertices.extend((
+                left, bottom, right, bottom, right, top, left, top))
+            colors.extend(color * 4)
+        self.vertex_lists[name] = self.batch.add(
+            len(squares) * 4,
+            pyglet.gl.GL_QUADS,
+            self.groups[name],
+            ("v2i", vertices),
+            ("c4B", colors))
+
+
 class Wall(Entity):
 
     def __init__(self, properties, batch):
@@ -1226,7 +1294,32 @@ if __name__ == "__main__":
                         help="Enable or disable vsync")
     parser.add_argument("--skip-font", action="store_true",
                         help="Skip the installation of required fonts.")
+    parser.add_argument("--seed", type=int,
+                        help="Play every game with this seed, to get the "
+                        "same pieces as an earlier game (see highscores).")
+    parser.add_argument("--system-random", action="store_true",
+                        help="Use the random source of the OS for pieces, "
+                        "these games can't be reproduced with a seed.")
+    parser.add_argument("--batched-board", action="store_true",
+                        help="Draw the board with a few vertex lists instead "
+                        "of a sprite per block, faster for large grids.")
+    parser.add_argument("--autoplay", action="store_true",
+                        help="Let the computer play the games, "
+                        "for demos and soak tests.")
+    parser.add_argument("--profile", nargs="?", const="profile.csv",
+                        help="Measure the time spent in each part of every "
+                        "frame, shown with F3 and written to a csv file.")
+    parser.add_argument("--replay",
+                        help="Watch a recorded game from the replays folder, "
+                        "pause with Backspace or Esc.")
     args = parser.parse_args()
+    playback = None
+    if args.replay:
+        try:
+            playback = replay.load(args.replay)
+        except (OSError, ValueError) as e:
+            print("Could not read {}: {}".format(args.replay, e))
+            sys.exit(1)
     # install font if needed
     if not args.skip_font:
         success = util.install_font("font/FSEX300.ttf")
@@ -1235,5 +1328,12 @@ if __name__ == "__main__":
     vsync = True
     if args.disable_vsync:
         vsync = False
-    MainWindow(vsync)
+    MainWindow(
+        vsync,
+        args.seed,
+        args.system_random,
+        args.batched_board,
+        args.autoplay,
+        playback,
+        args.profile)
     pyglet.app.run()
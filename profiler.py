@@ -0,0 +1,101 @@
+# Welcome to Polyominomania
+# See the README.md and github.com/Jelmerro/Polyominomania for more details
+# Released into the public domain, see UNLICENSE for details
+__license__ = "UNLICENSE"
+
+import collections
+import csv
+import time
+
+import util
+
+# Sections of a frame that are timed, the loop includes the gravity,
+# labels and generation of the ticks it runs
+SECTIONS = ["loop", "gravity", "draw", "relabel", "generation"]
+# Amounts of things that are drawn, counted at the end of each frame
+COUNTS = ["sprites", "quads", "labels"]
+
+
+class Profiler:
+
+    def __init__(self, path, window=600):
+        """ Frame Profiler
+
+        Measures the time spent in each section of every frame,
+        by wrapping the functions of those sections.
+        Every frame is written to a csv file in milliseconds,
+        the overlay shows the percentiles of the most recent frames.
+        """
+        self.path = path
+        self.rows = collections.deque(maxlen=window)
+        self.current = dict.fromkeys(SECTIONS, 0.0)
+        self.frames = 0
+        self.last = time.perf_counter()
+        self.visible = True
+        self.labels = util.LabelPool()
+        self.file = open(path, "w", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(["frame"] + SECTIONS + COUNTS)
+
+    def wrap(self, section, func):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.current[section] += time.perf_counter() - start
+        return timed
+
+    def wrap_frame(self, func, counts):
+        # a frame ends when it has been drawn
+        timed = self.wrap("draw", func)
+
+        def frame(*args, **kwargs):
+            result = timed(*args, **kwargs)
+            self.end_frame(counts())
+            return result
+        return frame
+
+    def end_frame(self, counts):
+        now = time.perf_counter()
+        times = [now - self.last] + [self.current[s] for s in SECTIONS]
+        row = [round(t * 1000, 3) for t in times]
+        row += [counts.get(c, 0) for c in COUNTS]
+        self.last = now
+        self.current = dict.fromkeys(SECTIONS, 0.0)
+        self.rows.append(row)
+        self.writer.writerow(row)
+        self.frames += 1
+        # updating the text every frame would be measured as well
+        if self.visible and self.frames % 30 == 1:
+            self.make_labels()
+
+    def make_labels(self):
+        self.labels.begin()
+        height = 470
+        fs = 10
+        self.labels.add(
+            "{:<11}{:>8}{:>8}{:>8}".format("ms", "p50", "p95", "p99"),
+            fs, 4, height, (255, 255, 100, 255), False)
+        for column, name in enumerate(["frame"] + SECTIONS):
+            height -= fs + 2
+            values = util.percentiles(
+                [row[column] for row in self.rows], [50, 95, 99])
+            self.labels.add(
+                "{:<11}{:>8.2f}{:>8.2f}{:>8.2f}".format(name, *values),
+                fs, 4, height, (255, 255, 100, 255), False)
+        height -= fs + 2
+        counts = self.rows[-1][len(SECTIONS) + 1:]
+        self.labels.add(
+            "  ".join(
+                "{} {}".format(name, count)
+                for name, count in zip(COUNTS, counts)),
+            fs, 4, height, (255, 255, 100, 255), False)
+        self.labels.end()
+
+    def draw(self):
+        if self.visible and self.rows:
+            self.labels.draw()
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,195 @@
+# Welcome to Polyominomania
+# See the README.md and github.com/Jelmerro/Polyominomania for more details
+# Released into the public domain, see UNLICENSE for details
+__license__ = "UNLICENSE"
+
+import datetime
+import hashlib
+import itertools
+import json
+import os
+import struct
+import time
+from argparse import ArgumentParser
+
+import engine
+import polyomino
+
+# Header of the replay files, followed by the seed, the config as json and
+# the moves: magic, version, sha1 of the config, config length and the
+# number of moves. The seed can be any int, so it's stored as a varint
+REPLAY_HEADER = struct.Struct("<4sBxxx20sII")
+REPLAY_MAGIC = b"PLYR"
+REPLAY_VERSION = 2
+
+# Moves are stored as the ticks since the previous move and the index here
+ACTIONS = [
+    "start", "left", "right", "rotate", "rotate_ccw", "down", "drop",
+    "gravity"
+]
+
+
+def fingerprint(config):
+    return hashlib.sha1(
+        json.dumps(config, sort_keys=True).encode()).digest()
+
+
+def write_varint(buffer, number):
+    # groups of 7 bits with the high bit set if another group follows
+    while number > 127:
+        buffer.append(number & 127 | 128)
+        number >>= 7
+    buffer.append(number)
+
+
+def read_varint(data, position):
+    # returns the number and the position after it
+    number = 0
+    shift = 0
+    while data[position] & 128:
+        number |= (data[position] & 127) << shift
+        shift += 7
+        position += 1
+    return number | data[position] << shift, position + 1
+
+
+class Recorder:
+
+    def __init__(self, seed, config):
+        """ Replay Recorder
+
+        Collects the moves of a game with the tick they were made at,
+        together with the seed and config they are needed to play it again.
+        """
+        self.seed = seed
+        self.config = config
+        self.moves = bytearray()
+        self.count = 0
+        self.tick = 0
+
+    def record(self, tick, action):
+        # ticks are written as the difference with the previous move
+        write_varint(self.moves, tick - self.tick)
+        self.tick = tick
+        self.moves.append(ACTIONS.index(action))
+        self.count += 1
+
+    def data(self):
+        config = json.dumps(self.config, separators=(",", ":")).encode()
+        header = REPLAY_HEADER.pack(
+            REPLAY_MAGIC,
+            REPLAY_VERSION,
+            fingerprint(self.config),
+            len(config),
+            self.count)
+        # negative seeds are folded in between the positive ones
+        seed = bytearray()
+        if self.seed >= 0:
+            write_varint(seed, self.seed * 2)
+        else:
+            write_varint(seed, ~self.seed * 2 + 1)
+        return header + seed + config + bytes(self.moves)
+
+    def save(self):
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        try:
+            os.makedirs("replays", exist_ok=True)
+            # never overwrite a replay, games can end in the same second
+            for attempt in itertools.count(1):
+                name = "{}-{}.bin".format(stamp, self.seed)
+                if attempt > 1:
+                    name = "{}-{}-{}.bin".format(stamp, self.seed, attempt)
+                path = os.path.join("replays", name)
+                try:
+                    with open(path, "xb") as f:
+                        f.write(self.data())
+                    return path
+                except FileExistsError:
+                    continue
+        except OSError:
+            return None
+
+
+class Replay:
+
+    def __init__(self, data):
+        """ Replay
+
+        A recorded game, read from the data of a replay file.
+        Raises a ValueError if the data is not a valid replay.
+        """
+        if len(data) < REPLAY_HEADER.size:
+            raise ValueError("Replay file is too short")
+        magic, version, config_hash, length, count = \
+            REPLAY_HEADER.unpack_from(data)
+        if magic != REPLAY_MAGIC:
+            raise ValueError("Not a replay file")
+        if version != REPLAY_VERSION:
+            raise ValueError("Unsupported replay version {}".format(version))
+        try:
+            seed, start = read_varint(data, REPLAY_HEADER.size)
+        except IndexError:
+            raise ValueError("Replay seed is incomplete")
+        try:
+            self.config = json.loads(data[start:start + length].decode())
+        except (UnicodeDecodeError, json.decoder.JSONDecodeError):
+            raise ValueError("Replay config is not valid json")
+        if fingerprint(self.config) != config_hash:
+            raise ValueError("Replay config does not match its fingerprint")
+        self.seed = seed // 2 if seed % 2 == 0 else ~(seed // 2)
+        self.fingerprint = config_hash
+        self.moves = []
+        position = start + length
+        tick = 0
+        try:
+            for _ in range(0, count):
+                delta, position = read_varint(data, position)
+                tick += delta
+                self.moves.append((tick, ACTIONS[data[position]]))
+                position += 1
+        except IndexError:
+            raise ValueError("Replay moves are incomplete")
+
+    def ticks(self):
+        if not self.moves:
+            return 0
+        return self.moves[-1][0]
+
+
+def load(path):
+    with open(path, "rb") as f:
+        return Replay(f.read())
+
+
+def play(replay):
+    # play all the moves as fast as possible, without a window
+    game = engine.Engine(replay.config, polyomino.make_rng(replay.seed))
+    game.load_pieces()
+    for _, action in replay.moves:
+        game.act(action)
+        game.pop_events()
+    return game
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Play a replay without a window, "
+                            "to check the result and how fast it runs.")
+    parser.add_argument("replay", help="Replay file to play.")
+    args = parser.parse_args()
+    try:
+        recorded = load(args.replay)
+    except (OSError, ValueError) as e:
+        print("Could not read {}: {}".format(args.replay, e))
+        raise SystemExit(1)
+    start = time.perf_counter()
+    game = play(recorded)
+    seconds = time.perf_counter() - start
+    print("Seed {}, {} moves in {} ticks".format(
+        recorded.seed, len(recorded.moves), recorded.ticks()))
+    print("Score {}, lines {}, level {}, {}".format(
+        game.score,
+        game.lines,
+        game.current_level,
+        "game over" if game.game_over else "still playing"))
+    print("Played in {:.3f} seconds, {:.0f} ticks per second".format(
+        seconds, recorded.ticks() / max(seconds, 1e-9)))
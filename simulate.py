@@ -0,0 +1,129 @@
+# Welcome to Polyominomania
+# See the README.md and github.com/Jelmerro/Polyominomania for more details
+# Released into the public domain, see UNLICENSE for details
+__license__ = "UNLICENSE"
+
+import multiprocessing
+import os
+from argparse import ArgumentParser
+
+import bot
+import catalog
+import engine
+import polyomino
+import util
+
+
+def wait(game, clock, move_time):
+    # let gravity catch up with the time a move took,
+    # returns the new clock and whether the piece is still falling
+    clock += move_time
+    while clock >= game.interval:
+        clock -= game.interval
+        if not game.drop_piece():
+            return clock, False
+    return clock, True
+
+
+def place(player, game, clock, move_time):
+    # follow the plan of the bot, gravity can get in the way of a move,
+    # then the bot makes a new plan from where the piece is now
+    for action in player.plan(game):
+        if not player.act(game, action):
+            if action == "down":
+                return clock
+            return place(player, game, clock, move_time)
+        if action == "drop":
+            return clock
+        clock, falling = wait(game, clock, move_time)
+        if not falling:
+            return clock
+    return clock
+
+
+def play(task):
+    config, seed, max_pieces, move_time = task
+    game = engine.Engine(config, polyomino.make_rng(seed))
+    game.load_pieces()
+    game.start()
+    player = bot.Bot()
+    pieces = 0
+    clock = 0.0
+    while not game.game_over and pieces < max_pieces:
+        clock = place(player, game, clock, move_time)
+        game.pop_events()
+        pieces += 1
+    return {
+        "score": game.score,
+        "lines": game.lines,
+        "level": game.current_level,
+        "pieces": pieces,
+        "survived": not game.game_over
+    }
+
+
+def simulate(config, games, max_pieces, move_time, seed, processes):
+    # generate the piece sets once, so all processes can read the cache
+    engine.Engine(config, polyomino.make_rng(seed)).load_pieces()
+    tasks = [
+        (config, seed + game, max_pieces, move_time)
+        for game in range(0, games)]
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes) as pool:
+        return list(pool.imap(play, tasks, max(1, games // processes // 8)))
+
+
+def report(name, results, max_pieces):
+    print("{}: {} games".format(name, len(results)))
+    for field in ["score", "lines", "level", "pieces"]:
+        values = [result[field] for result in results]
+        print("  {:<7} mean {:>10.1f}  p10 {:>8}  p50 {:>8}  p90 {:>8}  "
+              "max {:>8}".format(
+                  field,
+                  sum(values) / len(values),
+                  *util.percentiles(values, [10, 50, 90]),
+                  max(values)))
+    survived = sum(1 for result in results if result["survived"])
+    print("  survived {:.1f}% of the games up to {} pieces".format(
+        survived / len(results) * 100, max_pieces))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Play automated games of each mode "
+                            "to see how the settings affect the results.")
+    parser.add_argument("modes", nargs="*",
+                        help="Mode files to simulate, all modes by default.")
+    parser.add_argument("--games", type=int, default=1000,
+                        help="Number of games to play for each mode.")
+    parser.add_argument("--max-pieces", type=int, default=500,
+                        help="Games that survive this many pieces are "
+                        "stopped.")
+    parser.add_argument("--move-time", type=float, default=0.1,
+                        help="Seconds each rotation or move takes, "
+                        "so gravity keeps up with the speed of the mode.")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed of the first game, the others follow.")
+    parser.add_argument("--processes", type=int,
+                        default=os.cpu_count() or 1,
+                        help="Number of games played at the same time.")
+    args = parser.parse_args()
+    if args.games < 1:
+        parser.error("--games must be at least 1")
+    if args.processes < 1:
+        parser.error("--processes must be at least 1")
+    modes = args.modes
+    if not modes:
+        modes = [
+            os.path.join("modes", mode)
+            for mode in sorted(os.listdir("modes"))]
+    for mode in modes:
+        # the same checks as the menu, a broken mode shouldn't stop the rest
+        loaded = catalog.load_mode(mode)
+        if not loaded["valid"]:
+            print("{}: skipped, {}".format(
+                os.path.basename(mode), loaded["log"]))
+            continue
+        results = simulate(
+            loaded["config"], args.games, args.max_pieces, args.move_time,
+            args.seed, args.processes)
+        report(os.path.basename(mode), results, args.max_pieces)
@@ -8,9 +8,7 @@ import platform
 import pyglet
 import shutil
 import subprocess
-
-cur_w = 0
-cur_h = 0
+import weakref
 
 
 def install_font(font):
@@ -47,62 +45,137 @@ def install_font(font):
     return True
 
 
-def set_current_res(w, h):
-    global cur_w
-    global cur_h
-    cur_w = w
-    cur_h = h
-
-
-def res(pos_w, pos_h):
-    items = {}
-    global cur_w
-    global cur_h
-    des_w = 640
-    des_h = 480
-    if cur_w / des_w == cur_h / des_h:
-        items["wr"] = cur_w / des_w
-        items["hr"] = cur_h / des_h
-        items["w"] = pos_w * items["wr"]
-        items["h"] = pos_h * items["hr"]
-    elif cur_w / des_w > cur_h / des_h:
-        items["wr"] = cur_h / des_h
-        items["hr"] = cur_h / des_h
-        items["w"] = ((cur_w - items["wr"] * des_w) / 2) + pos_w * items["wr"]
-        items["h"] = pos_h * items["hr"]
-    else:
-        items["wr"] = cur_w / des_w
-        items["hr"] = cur_w / des_w
-        items["w"] = pos_w * items["wr"]
-        items["h"] = ((cur_h - items["hr"] * des_h) / 2) + pos_h * items["hr"]
-    return items
+def letterbox(width, height):
+    # show the 640x480 layout as large as possible in the middle of the
+    # window, so everything can be drawn in layout coordinates
+    scale = min(width / 640, height / 480)
+    view_width = int(640 * scale)
+    view_height = int(480 * scale)
+    if not view_width or not view_height:
+        # minimized, nothing is drawn
+        return scale
+    pyglet.gl.glViewport(
+        (width - view_width) // 2,
+        (height - view_height) // 2,
+        view_width,
+        view_height)
+    # a layout unit is exactly the scale in pixels, the viewport is rounded
+    pyglet.gl.glMatrixMode(pyglet.gl.GL_PROJECTION)
+    pyglet.gl.glLoadIdentity()
+    pyglet.gl.glOrtho(
+        0, view_width / scale, 0, view_height / scale, -1, 1)
+    pyglet.gl.glMatrixMode(pyglet.gl.GL_MODELVIEW)
+    return scale
 
 
-def make_label(name, size, x, y, color, centered, batch):
-    position = res(x, y)
+def make_label(name, size, x, y, color, centered, batch, scale=1,
+               group=None):
+    # the text is laid out in window pixels, so the glyphs are rendered
+    # at the size they are shown and the group scales them back
     if centered:
         label = pyglet.text.Label(
             name,
             font_name="Fixedsys Excelsior 3.01",
-            font_size=int(size*position["wr"]),
+            font_size=size * scale,
             color=color,
-            x=int(position["w"]),
-            y=int(position["h"]),
+            x=round(x * scale),
+            y=round(y * scale),
             anchor_x="center",
             anchor_y="center",
-            batch=batch)
+            batch=batch,
+            group=group)
     else:
         label = pyglet.text.Label(
             name,
             font_name="Fixedsys Excelsior 3.01",
-            font_size=int(size*position["wr"]),
+            font_size=size * scale,
             color=color,
-            x=int(position["w"]),
-            y=int(position["h"]),
-            batch=batch)
+            x=round(x * scale),
+            y=round(y * scale),
+            batch=batch,
+            group=group)
     return label
 
 
+class LabelPool:
+
+    # all pools, to lay out their labels again when the window is resized
+    pools = weakref.WeakSet()
+    scale = 1
+    group = None
+
+    def __init__(self, batch=None):
+        """ Label Pool
+
+        Keeps a label for each slot, all of them drawn in a single batch.
+        Labels are reused when the same slot is shown again,
+        so only labels of which the text or style changed are updated.
+        Slots that are not shown between begin and end are removed.
+        Text is rendered at the scale of the window, so it stays sharp.
+        """
+        self.batch = batch
+        if self.batch is None:
+            self.batch = pyglet.graphics.Batch()
+        self.labels = {}
+        self.styles = {}
+        self.used = set()
+        LabelPool.pools.add(self)
+
+    @classmethod
+    def set_scale(cls, scale, group):
+        # only on resize, as all labels are made again at the new size,
+        # the group draws them at the inverse of the scale
+        if scale <= 0 or scale == cls.scale:
+            return
+        cls.scale = scale
+        cls.group = group
+        for pool in list(cls.pools):
+            pool.relayout()
+
+    def relayout(self):
+        for slot, label in list(self.labels.items()):
+            size, x, y, centered = self.styles[slot]
+            self.labels[slot] = make_label(
+                label.text, size, x, y, tuple(label.color), centered,
+                self.batch, LabelPool.scale, LabelPool.group)
+            label.delete()
+
+    def begin(self):
+        self.used = set()
+
+    def add(self, name, size, x, y, color, centered):
+        # numbered slots, in the order the labels are added
+        return self.label(len(self.used), name, size, x, y, color, centered)
+
+    def label(self, slot, name, size, x, y, color, centered):
+        self.used.add(slot)
+        style = (size, x, y, centered)
+        if slot in self.labels and self.styles[slot] == style:
+            label = self.labels[slot]
+            if label.text != name:
+                label.text = name
+            if tuple(label.color) != tuple(color):
+                label.color = color
+            return label
+        if slot in self.labels:
+            self.labels[slot].delete()
+        label = make_label(
+            name, size, x, y, color, centered, self.batch,
+            LabelPool.scale, LabelPool.group)
+        self.labels[slot] = label
+        self.styles[slot] = style
+        return label
+
+    def end(self):
+        for slot in list(self.labels):
+            if slot not in self.used:
+                self.labels.pop(slot).delete()
+                self.styles.pop(slot)
+
+    def draw(self):
+        self.batch.draw()
+
+
 def split(seq, n):
     current = 0
     limit = 5
@@ -123,3 +196,10 @@ def split(seq, n):
             out.append(word)
             current += 1
     return out
+
+
+def percentiles(values, percents):
+    values = sorted(values)
+    return [
+        values[min(len(values) - 1, int(len(values) * percent / 100))]
+        for percent in percents]